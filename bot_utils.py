@@ -1,26 +1,36 @@
 import asyncio
-import importlib
+import atexit
+import base64
+import bisect
+import functools
+import hashlib
 import json
 import logging
+import mmap
 import os
 import re
-import shutil
-import subprocess
+import struct
 import sys
+import threading
+import time
 import traceback
-import unittest
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
-import emoji
-
 from copy import deepcopy
-from datetime import datetime
-from typing import Optional, Union, Callable, AsyncIterator, Any
+from datetime import date, datetime, timedelta
+from typing import Optional, Union, Callable, AsyncIterator, Any, TYPE_CHECKING
 
-import aiohttp
 import discord
 from discord.ext import commands
 
+# emoji (large data tables), aiohttp, shutil and multiprocessing are only imported by the helpers that use them
+if TYPE_CHECKING:
+    import aiohttp
+
 dir_path = os.path.dirname(
     os.path.dirname(
         os.path.dirname(
@@ -73,26 +83,109 @@ def setup(bot, loop):
     else:
         pass
     
+    error_reporter.start()
+    loop_lag_monitor.start()
+    
+    # run the test suite in the background, so it doesn't delay startup
     try:
-        test_module = importlib.import_module("cogs.utils.BotUtils.tests.test_bot_utils")
-        test_module = importlib.reload(test_module)
-    except ModuleNotFoundError:
+        asyncio_task(run_self_test, task_group='botutils')
+    except RuntimeError:  # no running event loop
         print("Skipping BotUtils test suite")
-    except Exception as exc:
-        # If anything goes wrong importing the optional local test suite, skip it.
-        print(f"Skipping BotUtils test suite due to import error: {exc}")
-    else:
-        suite = unittest.TestLoader().loadTestsFromModule(test_module)
-        test_runner = unittest.TextTestRunner(verbosity=1)
-        # Verbosity:
-        # 0 (quiet): you just get the total numbers of tests executed and the global result
-        # 1 (default): you get the same plus a dot for every successful test or a F for every failure
-        # 2 (verbose): you get the help string of every test and the result
-        test_runner.run(suite)
+
+
+class SelfTestFailure(Exception):
+    """Reported through error_reporter when the BotUtils test suite fails"""
+
+
+_SELF_TEST_MODULE = "cogs.utils.BotUtils.tests.test_bot_utils"
+_SELF_TEST_CACHE = os.path.join(dir_path, '.botutils_self_test.json')
+
+
+def _self_test_sources() -> list[str]:
+    """The files whose contents decide whether the test suite needs to run again"""
+    package_dir = os.path.dirname(os.path.realpath(__file__))
+    tests_dir = os.path.join(package_dir, 'tests')
+    sources = [os.path.join(package_dir, file_name) for file_name in sorted(os.listdir(package_dir))
+               if file_name.endswith('.py')]
+    if os.path.isdir(tests_dir):
+        sources += [os.path.join(tests_dir, file_name) for file_name in sorted(os.listdir(tests_dir))
+                    if file_name.endswith('.py')]
+    return sources
+
+
+def _source_hash(paths: list[str]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as read_file:
+            digest.update(read_file.read())
+    return digest.hexdigest()
+
+
+def _read_self_test_cache() -> Optional[str]:
+    try:
+        with open(_SELF_TEST_CACHE, 'r') as read_file:
+            return json.load(read_file).get('passed_hash')
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+
+def _write_self_test_cache(source_hash: str):
+    with open(_SELF_TEST_CACHE, 'w') as write_file:
+        json.dump({'passed_hash': source_hash, 'time': time.time()}, write_file)
+
+
+async def run_self_test(timeout: float = 300) -> Optional[bool]:
+    """Run the BotUtils test suite in a subprocess, unless it already passed for the current source files.
+
+    Returns True/False for a pass/fail, or None if the run was skipped. Failures go to error_reporter."""
+    sources = await executor_pools.run('io', _self_test_sources)
+    if not any(os.path.basename(path) == 'test_bot_utils.py' for path in sources):
+        print("Skipping BotUtils test suite")
+        return None
+    source_hash = await executor_pools.run('io', _source_hash, sources)
+    if await executor_pools.run('io', _read_self_test_cache) == source_hash:
+        return None
+
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "unittest", _SELF_TEST_MODULE,
+        cwd=dir_path,
+        env=dict(os.environ, BOTUTILS_SELF_TEST='1'),  # lets timing-sensitive tests skip themselves
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        output = f"Timed out after {timeout}s".encode()
+
+    if process.returncode == 0:
+        await executor_pools.run('io', _write_self_test_cache, source_hash)
+        return True
+
+    output = output.decode(errors='replace')
+    error_reporter.submit(here.bot, "BotUtils self-test", SelfTestFailure(f"BotUtils tests failed:\n{output[-3000:]}"))
+    return False
+
+
+class _LazyPattern:
+    """A regex that's only compiled the first time it's used"""
+    __slots__ = ('_args', '_pattern')
+
+    def __init__(self, *args):
+        self._args = args
+        self._pattern: Optional[re.Pattern] = None
+
+    def __getattr__(self, name):
+        if self._pattern is None:
+            self._pattern = re.compile(*self._args)
+        return getattr(self._pattern, name)
 
 
 # credit: https://gist.github.com/dperini/729294
-_url = re.compile(
+_url = _LazyPattern(
     r"""
             # protocol identifier
             (?:https?|ftp)://
@@ -131,6 +224,127 @@ _url = re.compile(
 _emoji = re.compile(r'<a?(:[A-Za-z0-9_]+:|#|@|@&)!?[0-9]{17,20}>')
 
 
+class _HelperStats:
+    """Counters for one instrumented helper. Updating them doesn't allocate: the histogram is a fixed array."""
+    __slots__ = ('calls', 'errors', 'total_seconds', 'buckets')
+
+    def __init__(self, bucket_count: int):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.buckets = array('Q', [0]) * bucket_count
+
+
+class Instrumentation:
+    """Opt-in call counts, error counts and latency histograms for the helpers decorated with @instrumented.
+
+    Disabled by default (then the decorator only costs a flag check). Turn it on with enable() or by setting the
+    BOTUTILS_METRICS environment variable to 1. Read the numbers with snapshot(), or write them in Prometheus'
+    text format with write_prometheus()."""
+    LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)  # upper bounds in seconds
+
+    def __init__(self):
+        self.enabled = os.getenv("BOTUTILS_METRICS") == "1"
+        self.helpers: dict[str, _HelperStats] = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def register(self, name: str) -> _HelperStats:
+        if name not in self.helpers:
+            self.helpers[name] = _HelperStats(len(self.LATENCY_BUCKETS) + 1)
+        return self.helpers[name]
+
+    def observe(self, stats: _HelperStats, seconds: float, failed: bool):
+        stats.calls += 1
+        if failed:
+            stats.errors += 1
+        stats.total_seconds += seconds
+        stats.buckets[bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+
+    def reset(self):
+        for stats in self.helpers.values():  # reset in place, the decorated functions hold on to their stats
+            stats.calls = stats.errors = 0
+            stats.total_seconds = 0.0
+            for index in range(len(stats.buckets)):
+                stats.buckets[index] = 0
+
+    def snapshot(self) -> dict[str, dict]:
+        """{helper: {'calls', 'errors', 'total_seconds', 'histogram': {upper bound: count}}} (not cumulative)"""
+        bounds = [str(bound) for bound in self.LATENCY_BUCKETS] + ["+Inf"]
+        return {name: {'calls': stats.calls, 'errors': stats.errors, 'total_seconds': stats.total_seconds,
+                       'histogram': dict(zip(bounds, stats.buckets))}
+                for name, stats in self.helpers.items()}
+
+    def prometheus_text(self) -> str:
+        lines = ["# HELP botutils_helper_calls_total Calls to BotUtils helpers.",
+                 "# TYPE botutils_helper_calls_total counter"]
+        lines += [f'botutils_helper_calls_total{{helper="{name}"}} {stats.calls}'
+                  for name, stats in self.helpers.items()]
+        lines += ["# HELP botutils_helper_errors_total Calls to BotUtils helpers that raised.",
+                  "# TYPE botutils_helper_errors_total counter"]
+        lines += [f'botutils_helper_errors_total{{helper="{name}"}} {stats.errors}'
+                  for name, stats in self.helpers.items()]
+        lines += ["# HELP botutils_helper_latency_seconds Latency of BotUtils helpers.",
+                  "# TYPE botutils_helper_latency_seconds histogram"]
+        for name, stats in self.helpers.items():
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in self.LATENCY_BUCKETS] + ["+Inf"], stats.buckets):
+                cumulative += count
+                lines.append(f'botutils_helper_latency_seconds_bucket{{helper="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'botutils_helper_latency_seconds_sum{{helper="{name}"}} {stats.total_seconds}')
+            lines.append(f'botutils_helper_latency_seconds_count{{helper="{name}"}} {stats.calls}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str = os.path.join(dir_path, 'botutils_metrics.prom')):
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w') as write_file:
+            write_file.write(self.prometheus_text())
+        os.replace(temp_file, path)
+
+
+instrumentation = Instrumentation()
+
+
+def instrumented(func: Callable) -> Callable:
+    """Record calls, errors and latency of func (sync or async) in `instrumentation` while it's enabled"""
+    stats = instrumentation.register(func.__name__)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return await func(*args, **kwargs)
+            failed = False
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                instrumentation.observe(stats, time.perf_counter() - start, failed)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+        failed = False
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            instrumentation.observe(stats, time.perf_counter() - start, failed)
+    return wrapper
+
+
 def green_embed(text):
     return discord.Embed(description=text, color=0x23ddf1)
 
@@ -143,51 +357,156 @@ def grey_embed(text):
     return discord.Embed(description=text, color=0x848A84)
 
 
-def _run_git_command(*args: str, cwd: str = dir_path) -> str:
-    result = subprocess.run(
-        ["git", *args],
+async def _run_git_command(*args: str, cwd: str = dir_path, timeout: float = 60) -> str:
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
         cwd=cwd,
-        capture_output=True,
-        text=True,
-        check=False,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
     )
-    if result.returncode != 0:
-        stderr = (result.stderr or "").strip()
-        stdout = (result.stdout or "").strip()
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise RuntimeError(f"git {' '.join(args)} timed out after {timeout}s")
+    stdout = stdout.decode(errors='replace').strip()
+    if process.returncode != 0:
+        stderr = stderr.decode(errors='replace').strip()
         details = stderr or stdout or f"git {' '.join(args)} failed"
         raise RuntimeError(details)
-    return (result.stdout or "").strip()
+    return stdout
+
+
+class GitPullResult(str):
+    """What safe_git_pull() did. It's the summary message itself, as safe_git_pull() used to return,
+    with the details of the pull as attributes."""
+    def __new__(cls,
+                branch: str,
+                upstream: str,
+                old_head: str,
+                new_head: str,
+                changed_files: list[str],
+                message: str,
+                deleted_files: Optional[list[str]] = None):
+        result = super().__new__(cls, message)
+        result.branch = branch
+        result.upstream = upstream
+        result.old_head = old_head
+        result.new_head = new_head
+        result.changed_files = changed_files  # paths relative to the repo root; a submodule shows up as its path
+        result.deleted_files = deleted_files or []
+        return result
+
+    @property
+    def message(self) -> str:
+        return str.__str__(self)
+
+    @property
+    def updated(self) -> bool:
+        return self.old_head != self.new_head
+
+    @staticmethod
+    def _extensions(paths: list[str], cogs_dir: str) -> list[str]:
+        extensions = []
+        for path in paths:
+            directory, _, file_name = path.rpartition('/')
+            if directory == cogs_dir and file_name.endswith('.py'):
+                extensions.append(f"{cogs_dir.replace('/', '.')}.{file_name[:-3]}")
+        return extensions
+
+    def changed_extensions(self, cogs_dir: str = 'cogs') -> list[str]:
+        """Extension names ("cogs.logger") of the changed or added cog files directly inside cogs_dir"""
+        return self._extensions(self.changed_files, cogs_dir)
+
+    def deleted_extensions(self, cogs_dir: str = 'cogs') -> list[str]:
+        """Extension names of the cog files directly inside cogs_dir that the pull deleted"""
+        return self._extensions(self.deleted_files, cogs_dir)
+
+    def other_changes(self, cogs_dir: str = 'cogs') -> list[str]:
+        """Changed or deleted files that aren't cogs (main files, utils, submodules...), which a cog reload won't
+        pick up"""
+        extension_files = {f"{extension.replace('.', '/')}.py"
+                           for extension in self.changed_extensions(cogs_dir) + self.deleted_extensions(cogs_dir)}
+        return [path for path in self.changed_files + self.deleted_files if path not in extension_files]
+
+
+async def reload_changed_extensions(bot: commands.Bot, result: GitPullResult) \
+        -> tuple[list[str], dict[str, commands.ExtensionError]]:
+    """Reload the loaded cogs that safe_git_pull() changed, and unload the loaded ones it deleted.
+
+    Returns the extensions reloaded or unloaded, and {extension: error} for those that failed; one failing cog
+    (a syntax error, say) doesn't stop the others, and keeps running its old code.
+    Check result.other_changes() to see whether a restart is still needed."""
+    done = []
+    failed = {}
+    for extension in result.deleted_extensions():
+        if extension in bot.extensions:
+            try:
+                await bot.unload_extension(extension)
+            except commands.ExtensionError as e:
+                logging.error(f"Failed to unload {extension}: {e}")
+                failed[extension] = e
+            else:
+                done.append(extension)
+    for extension in result.changed_extensions():
+        if extension in bot.extensions:
+            try:
+                await bot.reload_extension(extension)
+            except commands.ExtensionError as e:
+                logging.error(f"Failed to reload {extension}: {e}")
+                failed[extension] = e
+            else:
+                done.append(extension)
+    return done, failed
 
 
-async def safe_git_pull(cwd: str = dir_path, force: bool = False) -> str:
+async def safe_git_pull(cwd: str = dir_path, force: bool = False, timeout: float = 120) -> GitPullResult:
     """Safely fast-forward the bot repo.
 
     Refuses to pull if the repo is dirty, detached, missing an upstream, ahead of upstream,
     or otherwise not in a straightforward fast-forward state.
+
+    Git runs in subprocesses without blocking the event loop; each command is killed after `timeout` seconds.
     """
+    async def git(*args: str) -> str:
+        return await _run_git_command(*args, cwd=cwd, timeout=timeout)
+    
     try:
-        inside_work_tree = _run_git_command("rev-parse", "--is-inside-work-tree", cwd=cwd)
+        inside_work_tree = await git("rev-parse", "--is-inside-work-tree")
         if inside_work_tree != "true":
             raise RuntimeError("Not inside a git worktree.")
 
-        branch = _run_git_command("symbolic-ref", "--short", "HEAD", cwd=cwd)
+        # independent status queries, run together; errors are raised in the order they'd be checked one by one
+        status_results = await asyncio.gather(
+            git("symbolic-ref", "--short", "HEAD"),
+            git("status", "--porcelain"),
+            git("rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}"),
+            git("rev-parse", "HEAD"),
+            return_exceptions=True,
+        )
+        for status_result in status_results[:2]:
+            if isinstance(status_result, BaseException):
+                raise status_result
+        branch, dirty, upstream, old_head = status_results
 
-        dirty = _run_git_command("status", "--porcelain", cwd=cwd)
         if dirty:
-            tracked_dirty = bool(_run_git_command("diff", "--name-only", "HEAD", "--", cwd=cwd))
+            tracked_dirty = bool(await git("diff", "--name-only", "HEAD", "--"))
             if tracked_dirty and force:
-                _run_git_command("reset", "--hard", "HEAD", cwd=cwd)
-                dirty = _run_git_command("status", "--porcelain", cwd=cwd)
+                await git("reset", "--hard", "HEAD")
+                dirty = await git("status", "--porcelain")
 
             if dirty:
                 raise RuntimeError("Refusing to pull: worktree has uncommitted or untracked changes.")
 
-        upstream = _run_git_command("rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}", cwd=cwd)
+        for status_result in status_results[2:]:
+            if isinstance(status_result, BaseException):
+                raise status_result
         if not upstream:
             raise RuntimeError("Refusing to pull: current branch has no upstream configured.")
 
-        _run_git_command("fetch", "--prune", "--quiet", cwd=cwd)
-        ahead_behind = _run_git_command("rev-list", "--left-right", "--count", "HEAD...@{u}", cwd=cwd)
+        await git("fetch", "--prune", "--quiet")
+        ahead_behind = await git("rev-list", "--left-right", "--count", "HEAD...@{u}")
         ahead_str, behind_str = ahead_behind.split()
         ahead = int(ahead_str)
         behind = int(behind_str)
@@ -195,24 +514,31 @@ async def safe_git_pull(cwd: str = dir_path, force: bool = False) -> str:
         if ahead:
             raise RuntimeError(f"Refusing to pull: branch '{branch}' is ahead of '{upstream}' by {ahead} commit(s).")
         if behind == 0:
-            return f"Already up to date on {branch}."
+            return GitPullResult(branch, upstream, old_head, old_head, [], f"Already up to date on {branch}.")
 
-        pull_output = _run_git_command("pull", "--ff-only", "--no-rebase", cwd=cwd)
-        sync_output = _run_git_command("submodule", "sync", "--recursive", cwd=cwd)
-        submodule_output = _run_git_command("submodule", "update", "--init", "--recursive", cwd=cwd)
+        pull_output = await git("pull", "--ff-only", "--no-rebase")
+        sync_output = await git("submodule", "sync", "--recursive")
+        submodule_output = await git("submodule", "update", "--init", "--recursive")
 
-        post_dirty = _run_git_command("status", "--porcelain", cwd=cwd)
+        post_dirty, new_head = await asyncio.gather(git("status", "--porcelain"), git("rev-parse", "HEAD"))
         if post_dirty:
             raise RuntimeError("Git pull completed but left unexpected worktree changes.")
+        changed_files, deleted_files = await asyncio.gather(
+            git("diff", "--name-only", "--diff-filter=d", old_head, new_head),
+            git("diff", "--name-only", "--diff-filter=D", old_head, new_head))
 
         output_parts = [part for part in [pull_output, sync_output, submodule_output] if part]
         if output_parts:
-            return "\n".join(output_parts)
-        return f"Fast-forwarded {branch} from {upstream} and updated submodules."
+            message = "\n".join(output_parts)
+        else:
+            message = f"Fast-forwarded {branch} from {upstream} and updated submodules."
+        return GitPullResult(branch, upstream, old_head, new_head, changed_files.splitlines(), message,
+                             deleted_files.splitlines())
     except (ValueError, RuntimeError) as exc:
         raise RuntimeError(f"safe_git_pull aborted: {exc}") from exc
 
 
+@instrumented
 async def safe_send(destination: Union[commands.Context, discord.abc.Messageable],
                     content='', *,
                     embed: discord.Embed = None,
@@ -301,6 +627,7 @@ async def safe_reply(message: Union[discord.Message, commands.Context], content:
     return msg
 
 
+@instrumented
 async def member_converter(ctx: commands.Context, user_in: Union[str, int]) -> Optional[discord.Member]:
     # check for an ID
     if isinstance(user_in, int):
@@ -353,6 +680,7 @@ async def member_converter(ctx: commands.Context, user_in: Union[str, int]) -> O
     return None
 
 
+@instrumented
 async def user_converter(ctx: commands.Context, user_in: Union[str, int]) -> Union[None, discord.User, discord.Member]:
     """Doesn't convert to a member first, try doing utils.member_converter() before utils.user_converter()."""
     if isinstance(user_in, int):
@@ -369,6 +697,237 @@ async def user_converter(ctx: commands.Context, user_in: Union[str, int]) -> Uni
             return None
 
 
+class MessageQueueStore:
+    """Append-only on-disk store for bot.message_queue, replacing its JSON dump.
+
+    dump_json('message_queue') calls sync() with the queue's to_dict_list(). Each message is stored once, keyed by
+    a hash of its compact JSON, so a sync only writes the messages that are new or changed since the last one,
+    followed by a snapshot entry: the keys of every message in the queue, in order. load() decodes just the
+    messages of the latest snapshot, so what it returns is exactly the queue at the last dump, with no duplicates
+    and no longer than the queue's own limit.
+
+    Entries are written to segment files in `directory`, each one a 17-byte header (entry kind, payload length,
+    key, CRC32) followed by the payload. A segment is closed once it reaches `segment_size` bytes, and past
+    `max_segments` segments the oldest file is deleted, after copying over the entries in it that the queue
+    still needs. Segments are read back through mmap.
+    Enable it with use_message_queue_store()."""
+    HEADER = struct.Struct('<BI8sI')  # entry kind, payload length, key, CRC32 of key + payload
+    RECORD = 0  # payload: one message as compact JSON
+    SNAPSHOT = 1  # payload: the 8-byte keys of the messages in the queue, oldest first
+
+    def __init__(self,
+                 directory: str = os.path.join(dir_path, 'message_queue_segments'),
+                 segment_size: int = 4_000_000,
+                 max_segments: int = 16):
+        if segment_size < 1 or max_segments < 1:
+            raise ValueError("segment_size and max_segments must be positive")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self._file = None
+        self._file_number = -1
+        self._file_lock = threading.Lock()
+        # where each stored message is, as key -> (segment number, entry offset, entry length); built by _scan()
+        self._index: Optional[dict[bytes, tuple[int, int, int]]] = None
+        self._snapshot: list[bytes] = []
+        self._snapshot_at: Optional[tuple[int, int, int]] = None
+        self._live: set[bytes] = set()  # keys that must survive a segment being deleted
+
+    def segments(self) -> list[str]:
+        """Paths of the segment files, oldest first"""
+        try:
+            file_names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, file_name) for file_name in sorted(file_names)
+                if file_name.endswith('.seg')]
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, f'{number:010d}.seg')
+
+    @staticmethod
+    def _map(path: str) -> Optional[mmap.mmap]:
+        with open(path, 'rb') as read_file:
+            if not os.fstat(read_file.fileno()).st_size:
+                return None
+            return mmap.mmap(read_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _iter_entries(self, path: str, mapped: mmap.mmap):
+        """(kind, key, entry offset, entry length) of each entry in a segment, up to a torn or corrupt one"""
+        view = memoryview(mapped)
+        try:
+            offset = 0
+            header_size = self.HEADER.size
+            while offset + header_size <= len(view):
+                kind, length, key, crc = self.HEADER.unpack_from(view, offset)
+                start = offset + header_size
+                if start + length > len(view) or zlib.crc32(view[start:start + length], zlib.crc32(key)) != crc:
+                    logging.warning(f"Ignoring the truncated or corrupt end of {path}")
+                    return
+                yield kind, key, offset, header_size + length
+                offset = start + length
+        finally:
+            view.release()
+
+    def _scan(self):
+        """Index the stored messages and find the latest snapshot, without decoding any JSON"""
+        self._index = {}
+        self._snapshot = []
+        self._snapshot_at = None
+        for path in self.segments():
+            number = int(os.path.basename(path)[:-4])
+            mapped = self._map(path)
+            if mapped is None:
+                continue
+            with mapped:
+                for kind, key, offset, length in self._iter_entries(path, mapped):
+                    if kind == self.RECORD:
+                        self._index[key] = (number, offset, length)
+                    elif kind == self.SNAPSHOT:
+                        keys = mapped[offset + self.HEADER.size:offset + length]
+                        self._snapshot = [keys[i:i + 8] for i in range(0, len(keys), 8)]
+                        self._snapshot_at = (number, offset, length)
+
+    def _open_segment(self):
+        # Always start a new segment instead of appending to the last one, which may end in a torn write
+        if self._file is not None:
+            self._flush_locked()  # on disk before any older segment is deleted
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.segments()
+        self._file_number = int(os.path.basename(segments[-1])[:-4]) + 1 if segments else 0
+        self._file = open(self._path(self._file_number), 'ab')
+        evicted = segments[:max(len(segments) + 1 - self.max_segments, 0)]
+        for path in evicted:
+            self._carry_forward(int(os.path.basename(path)[:-4]))
+        if evicted:
+            self._flush_locked()  # the copies have to be durable before their originals go
+            for path in evicted:
+                os.remove(path)
+
+    def _carry_forward(self, number: int):
+        """Copy the entries of a segment about to be deleted that are still needed into the current segment"""
+        stored = [(key, offset, length) for key, (segment, offset, length) in self._index.items() if segment == number]
+        snapshot_stored = self._snapshot_at is not None and self._snapshot_at[0] == number
+        if not stored and not snapshot_stored:
+            return
+        with open(self._path(number), 'rb') as read_file:
+            data = read_file.read()
+        for key, offset, length in stored:
+            if key in self._live:
+                self._index[key] = (self._file_number, self._file.tell(), length)
+                self._file.write(data[offset:offset + length])
+            else:
+                del self._index[key]
+        if snapshot_stored:
+            _, offset, length = self._snapshot_at
+            self._snapshot_at = (self._file_number, self._file.tell(), length)
+            self._file.write(data[offset:offset + length])
+
+    def _write_entry(self, kind: int, key: bytes, payload: bytes):
+        entry = self.HEADER.pack(kind, len(payload), key, zlib.crc32(payload, zlib.crc32(key))) + payload
+        if self._file is None or (self._file.tell() and self._file.tell() + len(entry) > self.segment_size):
+            self._open_segment()
+        location = (self._file_number, self._file.tell(), len(entry))
+        self._file.write(entry)
+        if kind == self.RECORD:
+            self._index[key] = location
+        else:
+            self._snapshot_at = location
+
+    def sync(self, records: list[dict]):
+        """Store the queue's current messages (the dicts from MessageQueue.to_dict_list()).
+
+        Only writes the messages that aren't stored yet and the new snapshot. Blocking, so run it in an executor
+        from the event loop."""
+        keyed = []
+        for record in records:
+            payload = json.dumps(record, separators=(',', ':')).encode()
+            keyed.append((hashlib.blake2b(payload, digest_size=8).digest(), payload))
+        keys = [key for key, _ in keyed]
+
+        with self._file_lock:
+            if self._index is None:
+                self._scan()
+            # until the new snapshot is written, the previous one is what a restart would load
+            self._live = set(self._snapshot).union(keys)
+            for key, payload in keyed:
+                if key not in self._index:
+                    self._write_entry(self.RECORD, key, payload)
+            self._write_entry(self.SNAPSHOT, bytes(8), b''.join(keys))
+            self._snapshot = keys
+            self._live = set(keys)
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def flush(self):
+        """Write synced entries through to disk (sync() already does this)"""
+        with self._file_lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._file_lock:
+            self._flush_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def load(self) -> Optional[list[dict]]:
+        """The messages of the latest snapshot, oldest first, or None if nothing was ever synced"""
+        with self._file_lock:
+            self._flush_locked()
+            self._scan()
+            if self._snapshot_at is None:
+                return None
+
+            by_segment: dict[int, list[tuple[int, int, int]]] = {}
+            missing = 0
+            for position, key in enumerate(self._snapshot):
+                location = self._index.get(key)
+                if location is None:
+                    missing += 1
+                    continue
+                number, offset, length = location
+                by_segment.setdefault(number, []).append((position, offset, length))
+            if missing:
+                logging.warning(f"{missing} message(s) of the message queue snapshot are missing from the store")
+
+            records = [None] * len(self._snapshot)
+            for number, entries in by_segment.items():
+                with self._map(self._path(number)) as mapped:
+                    for position, offset, length in entries:
+                        records[position] = json.loads(mapped[offset + self.HEADER.size:offset + length])
+            return [record for record in records if record is not None]
+
+    def clear(self):
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for path in self.segments():
+                os.remove(path)
+            self._index = {}
+            self._snapshot = []
+            self._snapshot_at = None
+            self._live = set()
+
+
+message_queue_store: Optional[MessageQueueStore] = None
+
+
+def use_message_queue_store(**kwargs) -> MessageQueueStore:
+    """Persist bot.message_queue with a MessageQueueStore (see its docs) instead of message_queue.json.
+
+    Call before load_db(bot, 'message_queue'); the first time, the existing JSON file is copied into the store."""
+    global message_queue_store
+    message_queue_store = MessageQueueStore(**kwargs)
+    return message_queue_store
+
+
 def _json_dump_data(name: str = 'db'):
     if name == 'db':
         return deepcopy(here.bot.db)
@@ -376,8 +935,10 @@ def _json_dump_data(name: str = 'db'):
         return deepcopy(here.bot.stats)
     elif name == 'message_queue':
         return deepcopy(here.bot.message_queue.to_dict_list())
+    elif name == 'language_ratios':
+        return here.bot.language_ratios.to_dict()  # to_dict() already builds a fresh copy
     else:
-        raise ValueError("name must be 'db' or 'stats' or 'message_queue'")
+        raise ValueError("name must be 'db' or 'stats' or 'message_queue' or 'language_ratios'")
 
 
 def _write_json_dump(name: str, db_copy):
@@ -389,6 +950,7 @@ def _write_json_dump(name: str, db_copy):
         backup_dir = os.path.join(dir_path, 'database_backups_short')
         os.makedirs(backup_dir, exist_ok=True)
         backup_timestamp = discord.utils.utcnow().strftime('%Y%m%d_%H%M%S_%f')
+        import shutil
         shutil.copy2(source_file, os.path.join(backup_dir, f'{name}_{backup_timestamp}.json'))
 
     with open(temp_file, 'w') as write_file:
@@ -410,7 +972,13 @@ def _predump_json(name: str = 'db'):
     _write_json_dump(name, _json_dump_data(name))
 
 
-async def dump_json(name):
+def _sync_message_queue_store():
+    message_queue_store.sync(here.bot.message_queue.to_dict_list())
+
+
+@instrumented
+async def dump_json(name, executor: str = 'serialization'):
+    """Save a database to its JSON file, encoding it in one of the executor_pools pools"""
     # Wait up to five minutes for the lock to be released
     for _ in range(5):
         if _lock.locked():
@@ -424,12 +992,20 @@ async def dump_json(name):
         raise Exception("Attempted to call dump_json while _lock was locked; waiting five minutes didn't help.")
 
     async with _lock:
+        if name == 'message_queue' and message_queue_store:
+            # only the messages that changed since the last dump are written
+            try:
+                await executor_pools.run(executor, _sync_message_queue_store)
+            except RuntimeError:
+                print("Restarting dump_json on a RuntimeError")
+                await executor_pools.run(executor, message_queue_store.sync, _json_dump_data(name))
+            return
         try:
-            await here.loop.run_in_executor(None, _predump_json, name)
+            await executor_pools.run(executor, _predump_json, name)
         except RuntimeError:
             print("Restarting dump_json on a RuntimeError")
             db_copy = _json_dump_data(name)
-            await here.loop.run_in_executor(None, _write_json_dump, name, db_copy)
+            await executor_pools.run(executor, _write_json_dump, name, db_copy)
 
 
 def load_db(bot, name: str):
@@ -438,16 +1014,24 @@ def load_db(bot, name: str):
 
     Args:
         bot: The bot object whose attribute needs to be updated.
-        name (str): The name of the attribute to update. Must be 'db' or 'stats'.
+        name (str): The name of the attribute to update. Must be 'db', 'stats', 'message_queue'
+            or 'language_ratios'.
 
     Raises:
-        ValueError: If name is not 'db' or 'stats'.
+        ValueError: If name is not one of the above.
         FileNotFoundError: If the specified JSON file does not exist.
         PermissionError: If the program does not have permission to open the JSON file.
         json.decoder.JSONDecodeError: If there is an error decoding JSON data from the file.
     """
-    if name not in ['db', 'stats', 'message_queue']:
-        raise ValueError("name must be 'db' or 'stats' or 'message_queue'")
+    if name not in ['db', 'stats', 'message_queue', 'language_ratios']:
+        raise ValueError("name must be 'db' or 'stats' or 'message_queue' or 'language_ratios'")
+    if name == 'message_queue' and message_queue_store:
+        records = message_queue_store.load()
+        if records is not None:
+            # noinspection PyUnresolvedReferences
+            from ..helper_functions import MessageQueue
+            bot.message_queue = MessageQueue.from_dict(records)
+            return
     try:
         with open(f"{dir_path}/{name}.json", "r") as read_file1:
             read_file1.seek(0)
@@ -455,14 +1039,14 @@ def load_db(bot, name: str):
 
     except FileNotFoundError:
         logging.warning(f"File {name}.json not found.")
-        setattr(bot, name, {})
+        setattr(bot, name, _empty_db(name))
     except PermissionError:
         logging.error(f"Permission denied when opening {name}.json.")
         raise
     except json.decoder.JSONDecodeError as e:
         if e.msg == "Expecting value":
             logging.warning(f"No data detected in {name}.json")
-            setattr(bot, name, {})
+            setattr(bot, name, _empty_db(name))
         else:
             logging.error(f"Error decoding JSON in {name}.json: {e}")
             raise
@@ -472,9 +1056,167 @@ def load_db(bot, name: str):
             # noinspection PyUnresolvedReferences
             from ..helper_functions import MessageQueue
             bot.message_queue = MessageQueue.from_dict(data)
+            if message_queue_store:
+                message_queue_store.sync(data)  # first run with the store: migrate the JSON data
+        elif name == 'language_ratios':
+            bot.language_ratios = LanguageRatioAggregator.from_dict(data)
         else:
             setattr(bot, name, data)
-            
+
+
+def _empty_db(name: str):
+    """The value load_db() falls back to when there's no saved data for name"""
+    if name == 'language_ratios':
+        return LanguageRatioAggregator()
+    return {}
+
+
+_daily_bucket = re.compile(r'^(\d{4})(\d{2})(\d{2})$')  # "20261019", the key format bot.stats uses per day
+# "2026-W42" (ISO week), or "2026-W01-12" for only the days of a week that fall in one month (here December)
+_weekly_bucket = re.compile(r'^(\d{4})-W(\d{2})(?:-(\d{2}))?$')
+_monthly_bucket = re.compile(r'^(\d{4})-(\d{2})$')  # "2026-10"
+
+
+def stats_bucket_range(key: str) -> Optional[tuple[date, date, str]]:
+    """(first day, day after the last day, 'daily'/'weekly'/'monthly') of a bot.stats time bucket key,
+    or None if the key isn't one"""
+    try:
+        if match := _daily_bucket.match(key):
+            start = date(int(match[1]), int(match[2]), int(match[3]))
+            return start, start + timedelta(days=1), 'daily'
+        if match := _weekly_bucket.match(key):
+            start = date.fromisocalendar(int(match[1]), int(match[2]), 1)
+            days = [start + timedelta(days=day) for day in range(7)]
+            if match[3]:  # the part of a week that straddles two months falling in one of them
+                days = [day for day in days if day.month == int(match[3])]
+                if not days:
+                    return None
+            return days[0], days[-1] + timedelta(days=1), 'weekly'
+        if match := _monthly_bucket.match(key):
+            start = date(int(match[1]), int(match[2]), 1)
+            return start, (start + timedelta(days=32)).replace(day=1), 'monthly'
+    except ValueError:  # not a real date
+        return None
+    return None
+
+
+def _merge_stats(into, value):
+    """Add a stats bucket's value into another: numbers are summed, dicts merged key by key, lists concatenated,
+    and anything else is replaced by the newer value"""
+    if into is None:
+        return value
+    if isinstance(into, dict) and isinstance(value, dict):
+        for key, sub_value in value.items():
+            into[key] = _merge_stats(into.get(key), sub_value)
+        return into
+    if isinstance(into, (int, float)) and isinstance(value, (int, float)) \
+            and not isinstance(into, bool) and not isinstance(value, bool):
+        return into + value
+    if isinstance(into, list) and isinstance(value, list):
+        return into + value
+    return value
+
+
+def _is_bucket_series(value) -> bool:
+    return isinstance(value, dict) and bool(value) and all(
+        isinstance(key, str) and stats_bucket_range(key) for key in value)
+
+
+def iter_stats_buckets(series: dict):
+    """(start, end, key, value) for each bucket of a time series in bot.stats, oldest first.
+    Raw daily buckets and rolled-up weekly/monthly buckets are returned alike."""
+    buckets = [(*stats_bucket_range(key)[:2], key, value) for key, value in series.items()]
+    buckets.sort(key=lambda bucket: (bucket[0], bucket[1]))
+    return iter(buckets)
+
+
+def sum_stats(series: dict, start: Optional[date] = None, end: Optional[date] = None):
+    """Merge (see _merge_stats) every bucket of a bot.stats time series that starts in [start, end).
+
+    Rolled-up buckets count whole when they start in the range, so near the edges of a range that reaches into
+    rolled-up data the result is only as precise as those buckets."""
+    total = None
+    for bucket_start, _, _, value in iter_stats_buckets(series):
+        if (start is None or bucket_start >= start) and (end is None or bucket_start < end):
+            total = _merge_stats(total, deepcopy(value))  # copied so bot.stats is never modified
+    return total
+
+
+class StatsRollup:
+    """Compacts old per-day data in bot.stats so it stops growing without bound.
+
+    Any dict in bot.stats whose keys are all day keys ("20261019") is a time series. Days older than `daily_days`
+    are merged into ISO week buckets ("2026-W42", or "2026-W01-12" and "2026-W01-01" for the two halves of a week
+    that straddles two months), and days or weeks older than `weekly_days` into month buckets ("2026-10"), using
+    _merge_stats(). Query the result with iter_stats_buckets() / sum_stats().
+    Run it in the background with start_stats_rollup()."""
+    def __init__(self, daily_days: int = 30, weekly_days: int = 182):
+        if not 0 < daily_days <= weekly_days:
+            raise ValueError("Need 0 < daily_days <= weekly_days")
+        self.daily_days = daily_days
+        self.weekly_days = weekly_days
+
+    def _iter_series(self, stats: dict):
+        for value in list(stats.values()):
+            if _is_bucket_series(value):
+                yield value
+            elif isinstance(value, dict):
+                yield from self._iter_series(value)
+
+    def compact_series(self, series: dict, today: Optional[date] = None) -> int:
+        """Roll up one time series in place. Returns how many buckets were merged away."""
+        today = today or discord.utils.utcnow().date()
+        daily_cutoff = today - timedelta(days=self.daily_days)
+        weekly_cutoff = today - timedelta(days=self.weekly_days)
+        merged = 0
+        for start, end, key, _ in iter_stats_buckets(series):
+            kind = stats_bucket_range(key)[2]
+            if kind == 'monthly' or (kind == 'daily' and start >= daily_cutoff):
+                continue
+            if end <= weekly_cutoff:
+                target = f"{start.year:04d}-{start.month:02d}"
+            elif kind == 'daily':
+                year, week, weekday = start.isocalendar()
+                target = f"{year:04d}-W{week:02d}"
+                week_start = start - timedelta(days=weekday - 1)
+                if week_start.month != (week_start + timedelta(days=6)).month:
+                    # split weeks at month boundaries, so that rolling them up into months later is exact
+                    target += f"-{start.month:02d}"
+            else:
+                continue
+            series[target] = _merge_stats(series.get(target), series.pop(key))
+            merged += 1
+        return merged
+
+    def compact(self, stats: dict, today: Optional[date] = None) -> int:
+        """Roll up every time series in stats. Returns how many buckets were merged away."""
+        return sum(self.compact_series(series, today) for series in list(self._iter_series(stats)))
+
+    async def compact_async(self, stats: dict, today: Optional[date] = None) -> int:
+        """compact(), giving the event loop a turn between series"""
+        merged = 0
+        for index, series in enumerate(list(self._iter_series(stats))):
+            merged += self.compact_series(series, today)
+            if index % 100 == 99:
+                await asyncio.sleep(0)
+        return merged
+
+
+stats_rollup = StatsRollup()
+
+
+async def _stats_rollup_loop(bot, interval: float):
+    while True:
+        async with _lock:  # don't change bot.stats while dump_json is copying it
+            merged = await stats_rollup.compact_async(bot.stats)
+        if merged:
+            logging.info(f"Rolled up {merged} old bot.stats buckets")
+        await asyncio.sleep(interval)
+
+
+def start_stats_rollup(bot, interval: float = 6 * 60 * 60) -> asyncio.Task:
+    """Compact bot.stats with stats_rollup now and then every `interval` seconds"""
+    return asyncio_task(_stats_rollup_loop, bot, interval, task_group='botutils')
 
 
 def rem_emoji_url(msg: Union[discord.Message, str]) -> str:
@@ -483,6 +1225,7 @@ def rem_emoji_url(msg: Union[discord.Message, str]) -> str:
     else:
         assert isinstance(msg, str), f"msg is not a string or discord.Message: {msg} ({type(msg)})"
         msg_content = msg
+    import emoji
     new_msg = _emoji.sub('', _url.sub('', msg_content))
     for char in msg_content:
         if emoji.is_emoji(char):
@@ -490,12 +1233,24 @@ def rem_emoji_url(msg: Union[discord.Message, str]) -> str:
     return new_msg
 
 
+@instrumented
 def jpenratio(msg_content: str) -> Optional[float]:
     text = _emoji.sub('', _url.sub('', msg_content))
     en, jp, total = get_character_spread(text)
     return en / total if total else None
 
 
+def _jpenratios(contents: list[str]) -> list[Optional[float]]:
+    return [jpenratio(content) for content in contents]
+
+
+async def jpenratio_many(contents: list[str], executor: str = 'cpu', chunk_size: int = 2000) -> list[Optional[float]]:
+    """jpenratio() for a large batch of messages, computed in chunks in one of the executor_pools pools"""
+    chunks = [contents[i:i + chunk_size] for i in range(0, len(contents), chunk_size)]
+    results = await asyncio.gather(*[executor_pools.run(executor, _jpenratios, chunk) for chunk in chunks])
+    return [ratio for chunk in results for ratio in chunk]
+
+
 def get_character_spread(text):
     english = 0
     japanese = 0
@@ -548,6 +1303,205 @@ def is_english(char):
     return any(start <= ord(char) <= end for start, end in RANGE_CHECK)
 
 
+class _RatioWindow:
+    """Rolling English/CJK character counts for one user or channel.
+
+    Keeps a ring buffer of the last `size` messages and a ring of `bucket_count` time buckets. Both are
+    fixed-size arrays, so memory per window never grows."""
+    __slots__ = ('msg_en', 'msg_jp', 'msg_pos', 'msg_en_total', 'msg_jp_total',
+                 'bucket_ids', 'bucket_en', 'bucket_jp')
+
+    def __init__(self, size: int, bucket_count: int):
+        self.msg_en = array('I', [0]) * size
+        self.msg_jp = array('I', [0]) * size
+        self.msg_pos = 0
+        self.msg_en_total = 0
+        self.msg_jp_total = 0
+        # bucket_ids holds the absolute bucket number (timestamp // bucket_seconds) stored at each slot
+        self.bucket_ids = array('q', [-1]) * bucket_count
+        self.bucket_en = array('I', [0]) * bucket_count
+        self.bucket_jp = array('I', [0]) * bucket_count
+
+    def add(self, english: int, japanese: int, bucket_id: int):
+        pos = self.msg_pos
+        self.msg_en_total += english - self.msg_en[pos]
+        self.msg_jp_total += japanese - self.msg_jp[pos]
+        self.msg_en[pos] = english
+        self.msg_jp[pos] = japanese
+        self.msg_pos = (pos + 1) % len(self.msg_en)
+
+        slot = bucket_id % len(self.bucket_ids)
+        if bucket_id < self.bucket_ids[slot]:
+            # a backfilled or replayed message from before the window; it must not wipe out a newer bucket
+            return
+        if self.bucket_ids[slot] != bucket_id:
+            self.bucket_ids[slot] = bucket_id
+            self.bucket_en[slot] = 0
+            self.bucket_jp[slot] = 0
+        self.bucket_en[slot] += english
+        self.bucket_jp[slot] += japanese
+
+    def message_counts(self) -> tuple[int, int]:
+        return self.msg_en_total, self.msg_jp_total
+
+    def time_counts(self, current_bucket_id: int) -> tuple[int, int]:
+        oldest = current_bucket_id - len(self.bucket_ids) + 1
+        english = japanese = 0
+        for slot, bucket_id in enumerate(self.bucket_ids):
+            if oldest <= bucket_id <= current_bucket_id:
+                english += self.bucket_en[slot]
+                japanese += self.bucket_jp[slot]
+        return english, japanese
+
+    def to_dict(self) -> dict:
+        """Compact form for the JSON dump: the filled message slots oldest first, and the used time buckets,
+        each as base64 of a little-endian array"""
+        size = len(self.msg_en)
+        order = [(self.msg_pos + i) % size for i in range(size)]
+        messages = array('H')  # one message can't have anywhere near 65535 characters
+        for pos in order:
+            if self.msg_en[pos] or self.msg_jp[pos]:  # add() skips messages with no counts, so (0, 0) is unused
+                messages.extend((min(self.msg_en[pos], 0xFFFF), min(self.msg_jp[pos], 0xFFFF)))
+        buckets = array('q')
+        for slot, bucket_id in enumerate(self.bucket_ids):
+            if bucket_id >= 0 and (self.bucket_en[slot] or self.bucket_jp[slot]):
+                buckets.extend((bucket_id, self.bucket_en[slot], self.bucket_jp[slot]))
+        return {'size': size, 'bucket_count': len(self.bucket_ids),
+                'messages': _pack_array(messages), 'buckets': _pack_array(buckets)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> '_RatioWindow':
+        window = cls(data['size'], data['bucket_count'])
+        messages = _unpack_array('H', data['messages'])
+        count = len(messages) // 2
+        window.msg_en[:count] = array('I', messages[0::2])
+        window.msg_jp[:count] = array('I', messages[1::2])
+        window.msg_pos = count % data['size']
+        window.msg_en_total = sum(window.msg_en)
+        window.msg_jp_total = sum(window.msg_jp)
+        buckets = _unpack_array('q', data['buckets'])
+        for i in range(0, len(buckets), 3):
+            slot = buckets[i] % data['bucket_count']
+            window.bucket_ids[slot] = buckets[i]
+            window.bucket_en[slot] = buckets[i + 1]
+            window.bucket_jp[slot] = buckets[i + 2]
+        return window
+
+
+def _pack_array(values: array) -> str:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode()
+
+
+def _unpack_array(typecode: str, data: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class LanguageRatioAggregator:
+    """Streaming English/CJK ratio tracker for users and channels.
+
+    Feed it messages with add_message() (or raw counts with add()) and query user_ratio() / channel_ratio().
+    Each user and channel gets a _RatioWindow covering the last `window_size` messages and the last
+    `bucket_count` * `bucket_seconds` seconds (24 hours by default). At most `max_keys` users and `max_keys`
+    channels are tracked; the least recently active ones are dropped first.
+
+    Saved and loaded like the other databases: dump_json('language_ratios') / load_db(bot, 'language_ratios')
+    """
+    def __init__(self,
+                 window_size: int = 100,
+                 bucket_count: int = 24,
+                 bucket_seconds: int = 3600,
+                 max_keys: int = 5_000):
+        if window_size < 1 or bucket_count < 1 or bucket_seconds < 1 or max_keys < 1:
+            raise ValueError("window_size, bucket_count, bucket_seconds and max_keys must all be positive")
+        self.window_size = window_size
+        self.bucket_count = bucket_count
+        self.bucket_seconds = bucket_seconds
+        self.max_keys = max_keys
+        self.users: OrderedDict[int, _RatioWindow] = OrderedDict()
+        self.channels: OrderedDict[int, _RatioWindow] = OrderedDict()
+
+    def _window(self, windows: OrderedDict, key: int) -> _RatioWindow:
+        window = windows.get(key)
+        if window is None:
+            window = windows[key] = _RatioWindow(self.window_size, self.bucket_count)
+            if len(windows) > self.max_keys:
+                windows.popitem(last=False)
+        else:
+            windows.move_to_end(key)
+        return window
+
+    def add(self,
+            user_id: Optional[int],
+            channel_id: Optional[int],
+            english: int,
+            japanese: int,
+            timestamp: Optional[float] = None):
+        """Record the character counts of one message. Messages with no English or CJK characters are ignored."""
+        if not english and not japanese:
+            return
+        bucket_id = int((timestamp if timestamp is not None else time.time()) // self.bucket_seconds)
+        if user_id is not None:
+            self._window(self.users, user_id).add(english, japanese, bucket_id)
+        if channel_id is not None:
+            self._window(self.channels, channel_id).add(english, japanese, bucket_id)
+
+    def add_message(self, msg: discord.Message) -> Optional[float]:
+        """Record a message and return its own ratio (same as jpenratio(msg.content))"""
+        text = _emoji.sub('', _url.sub('', msg.content))
+        english, japanese, total = get_character_spread(text)
+        self.add(msg.author.id, msg.channel.id, english, japanese, msg.created_at.timestamp())
+        return english / total if total else None
+
+    def _ratio(self, windows: OrderedDict, key: int, by_time: bool, now: Optional[float]) -> Optional[float]:
+        window = windows.get(key)
+        if window is None:
+            return None
+        if by_time:
+            current_bucket_id = int((now if now is not None else time.time()) // self.bucket_seconds)
+            english, japanese = window.time_counts(current_bucket_id)
+        else:
+            english, japanese = window.message_counts()
+        total = english + japanese
+        return english / total if total else None
+
+    def user_ratio(self, user_id: int, *, by_time: bool = False, now: Optional[float] = None) -> Optional[float]:
+        """English ratio of a user's recent messages, or None if there is no data.
+
+        By default covers the last `window_size` messages; with by_time=True covers the last
+        `bucket_count` time buckets instead."""
+        return self._ratio(self.users, user_id, by_time, now)
+
+    def channel_ratio(self, channel_id: int, *, by_time: bool = False, now: Optional[float] = None) -> Optional[float]:
+        """English ratio of a channel's recent messages, or None if there is no data. See user_ratio()."""
+        return self._ratio(self.channels, channel_id, by_time, now)
+
+    def to_dict(self) -> dict:
+        return {'window_size': self.window_size,
+                'bucket_count': self.bucket_count,
+                'bucket_seconds': self.bucket_seconds,
+                'max_keys': self.max_keys,
+                'users': {str(key): window.to_dict() for key, window in self.users.items()},
+                'channels': {str(key): window.to_dict() for key, window in self.channels.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LanguageRatioAggregator':
+        if not data:
+            return cls()
+        aggregator = cls(data['window_size'], data['bucket_count'], data['bucket_seconds'], data['max_keys'])
+        for key, window in data['users'].items():
+            aggregator.users[int(key)] = _RatioWindow.from_dict(window)
+        for key, window in data['channels'].items():
+            aggregator.channels[int(key)] = _RatioWindow.from_dict(window)
+        return aggregator
+
+
 async def send_error_embed(bot: discord.Client,
                            ctx_or_event: Union[commands.Context, discord.Interaction, str],
                            error: BaseException,
@@ -556,19 +1510,119 @@ async def send_error_embed(bot: discord.Client,
     - main.on_command_error
     - main.on_error
     - main.on_tree_error
-    - RaiView.on_error"""
+    - RaiView.on_error
+    
+    The error is only queued here; error_reporter formats and sends it in the background."""
     try:
-        await send_error_embed_internal(bot, ctx_or_event, error, *args, **kwargs)
+        error_reporter.submit(bot, ctx_or_event, error, *args)
     except Exception as e:
         exc = ''.join(traceback.format_exception(type(e), e, e.__traceback__, chain=False))
         logging.error(f"Error in send_error_embed: {exc}")
 
 
-async def send_error_embed_internal(bot: discord.Client,
-                                    ctx_or_event: Union[commands.Context, discord.Interaction, str],
-                                    error: BaseException,
-                                    *args, **kwargs):
-    
+def error_fingerprint(error: BaseException) -> str:
+    """A short hash identifying "the same error": the exception type plus the file name, function and source line
+    of every frame in its traceback (and in the tracebacks of the exceptions it was raised from). For a LoopStall
+    only the frame it's attributed to counts, since the rest of the sampled stack varies from stall to stall.
+
+    Line numbers and full paths are left out so the fingerprint survives unrelated edits and different machines."""
+    parts = []
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        parts.append(f"{type(error).__module__}.{type(error).__qualname__}")
+        if isinstance(error, LoopStall):
+            frames = [error.site] if error.site else []
+        else:
+            frames = traceback.extract_tb(error.__traceback__)
+        for frame in frames:
+            parts.append(f"{os.path.basename(frame.filename)}:{frame.name}:{frame.line}")
+        error = error.__cause__
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:12]
+
+
+class ErrorRateLimiter:
+    """Deduplicates error reports by fingerprint.
+
+    The first occurrence of a fingerprint is reported in full. Repeats within `window` seconds are only counted,
+    and pop_due_summaries() hands back one (fingerprint, label, count) summary per window for each of them.
+    A fingerprint that goes a full window without repeating is forgotten, so its next occurrence is sent in full
+    again."""
+    def __init__(self, window: float = 600):
+        self.window = window
+        self._entries: dict[str, list] = {}  # fingerprint: [window_start, repeat_count, label]
+
+    def hit(self, fingerprint: str, label: str, now: Optional[float] = None) -> bool:
+        """Record an occurrence and return True if it should be reported in full"""
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(fingerprint)
+        if entry is None or (not entry[1] and now - entry[0] >= self.window):
+            self._entries[fingerprint] = [now, 0, label]
+            return True
+        entry[1] += 1
+        return False
+
+    def pop_due_summaries(self, now: Optional[float] = None) -> list[tuple[str, str, int]]:
+        """Summaries for every fingerprint whose window has ended, starting a new window for each"""
+        now = time.monotonic() if now is None else now
+        summaries = []
+        for fingerprint, entry in list(self._entries.items()):
+            if now - entry[0] < self.window:
+                continue
+            if entry[1]:
+                summaries.append((fingerprint, entry[2], entry[1]))
+                entry[0] = now
+                entry[1] = 0
+            else:
+                del self._entries[fingerprint]
+        return summaries
+
+    def flush(self) -> list[tuple[str, str, int]]:
+        """Summaries for every fingerprint with uncounted repeats, forgetting everything (used on shutdown)"""
+        summaries = [(fingerprint, entry[2], entry[1]) for fingerprint, entry in self._entries.items() if entry[1]]
+        self._entries.clear()
+        return summaries
+
+    def next_due(self) -> Optional[float]:
+        """time.monotonic() time at which the next window ends, or None if nothing is being tracked"""
+        if not self._entries:
+            return None
+        return min(entry[0] for entry in self._entries.values()) + self.window
+
+
+# ignore certain parts of traceback text that are common across all tracebacks
+_TRACEBACK_SCRUB_PATTERNS = [
+    (_LazyPattern(r'File \".*(discord)'), r'File "...\1'),  # shorten discord.py file paths
+    (_LazyPattern(r'File \".*(Rai|DMModbot)'), r'File "...\1'),  # shorten Rai/DMModbot file paths
+    # below two lines will also delete ^^^^^^ if it's the line after the main ones being deleted
+    (_LazyPattern(r'File \".*\n.*await coro\(\*args, \*\*kwargs\).*\n(?:.*\^{3,}.*\n)?'), ''),  # delete lines that just print "await coro()"
+    (_LazyPattern(r'File \".*\n.*return await self\._callback.*\n(?:.*\^{3,}.*\n)?'), ''),  # delete "return await self._callback" lines
+]
+
+# ignore almost everything after this in an exception
+_TRACEBACK_SUPER_IGNORE = "The above exception was the direct cause of the following exception:"
+
+
+def _get_traceback_channel(bot: discord.Client) -> Optional[discord.abc.Messageable]:
+    traceback_logging_channel_id = os.getenv("ERROR_CHANNEL_ID") or os.getenv("TRACEBACK_LOGGING_CHANNEL")
+    if not traceback_logging_channel_id:
+        logging.error("No error channel ID found in environment variables.")
+        return None
+
+    traceback_channel = bot.get_channel(int(traceback_logging_channel_id))
+    if not traceback_channel:
+        logging.error(f"Could not find error logging channel with ID {traceback_logging_channel_id}.")
+        return None
+    return traceback_channel
+
+
+def _build_error_report(bot: discord.Client,
+                        ctx_or_event: Union[commands.Context, discord.Interaction, str],
+                        error: BaseException,
+                        fingerprint: str,
+                        *args) -> tuple[list[str], discord.Embed]:
+    """Log an error and build the messages reporting it: the traceback split into code blocks, plus an embed
+    describing where it happened (to be sent with the last code block)"""
     # Determine if it's a command/interaction or an event
     # this is a command error / application error
     if isinstance(ctx_or_event, (commands.Context, discord.Interaction)):
@@ -653,24 +1707,13 @@ async def send_error_embed_internal(bot: discord.Client,
     print(f'{error.__class__.__name__}: {error}', file=sys.stderr)
     
     exc = ''.join(traceback.format_exception(type(error), error, error.__traceback__, chain=True))
-    logging.error(f"Error in {qualified_name}: {exc}")
-    
-    # ignore certain parts of traceback text that are common across all tracebacks
-    ignore = [
-        (r'File \".*(discord)', r'File "...\1'),  # shorten discord.py file paths
-        (r'File \".*(Rai|DMModbot)', r'File "...\1'),  # shorten Rai/DMModbot file paths
-        # below two lines will also delete ^^^^^^ if it's the line after the main ones being deleted
-        (r'File \".*\n.*await coro\(\*args, \*\*kwargs\).*\n(?:.*\^{3,}.*\n)?', ''),  # delete lines that just print "await coro()"
-        (r'File \".*\n.*return await self\._callback.*\n(?:.*\^{3,}.*\n)?', ''),  # delete "return await self._callback" lines
-    ]
+    logging.error(f"Error in {qualified_name} ({fingerprint}): {exc}")
+    e.set_footer(text=f"Fingerprint: {fingerprint}")
     
-    for i, j in ignore:
-        exc = re.sub(i, j, exc)
+    for pattern, replacement in _TRACEBACK_SCRUB_PATTERNS:
+        exc = pattern.sub(replacement, exc)
     
-    # ignore almost everything after this in an exception
-    super_ignore = "The above exception was the direct cause of the following exception:"
-    
-    exc_split = exc.split(super_ignore)
+    exc_split = exc.split(_TRACEBACK_SUPER_IGNORE)
     # # below line replaces any filepath with just the final filename
     # # example: /long/file/path/name.file --> name.file
     # exc_split[1] = re.sub(r'File \".*/', r'File ".../', exc_split[1])  # file paths
@@ -683,33 +1726,494 @@ async def send_error_embed_internal(bot: discord.Client,
     
     # Split the traceback into multiple messages if it's too long
     traceback_segments = split_text_into_segments(exc, 1900)
-    
+    return [f"```py\n{segment}```" for segment in traceback_segments], e
+
+
+def _pack_error_messages(payloads: list[tuple[str, Optional[discord.Embed]]]) \
+        -> list[tuple[str, list[discord.Embed]]]:
+    """Combine consecutive (content, embed) pairs into as few messages as Discord's limits allow
+    (2000 characters of content, and 10 embeds totalling 6000 characters per message)"""
+    messages = []
+    embed_lengths = []  # combined len() of the embeds in each message
+    for content, embed in payloads:
+        embed_length = len(embed) if embed is not None else 0
+        if messages:
+            last_content, last_embeds = messages[-1]
+            if len(last_content) + 1 + len(content) <= 2000 and \
+                    (embed is None or (len(last_embeds) < 10 and embed_lengths[-1] + embed_length <= 6000)):
+                messages[-1] = (f"{last_content}\n{content}", last_embeds + ([embed] if embed else []))
+                embed_lengths[-1] += embed_length
+                continue
+        messages.append((content, [embed] if embed else []))
+        embed_lengths.append(embed_length)
+    return messages
+
+
+async def _send_error_messages(bot: discord.Client, payloads: list[tuple[str, Optional[discord.Embed]]]):
     # Get the logging channel
-    traceback_logging_channel_id = os.getenv("ERROR_CHANNEL_ID") or os.getenv("TRACEBACK_LOGGING_CHANNEL")
-    if not traceback_logging_channel_id:
-        logging.error("No error channel ID found in environment variables.")
-        return
-    
-    traceback_channel = bot.get_channel(int(traceback_logging_channel_id))
+    traceback_channel = _get_traceback_channel(bot)
     if not traceback_channel:
-        logging.error(f"Could not find error logging channel with ID {traceback_logging_channel_id}.")
         return
     
-    # Send the traceback in segments to avoid hitting the Discord limit
-    try:
-        for index, segment in enumerate(traceback_segments):
-            if index != len(traceback_segments) - 1:
-                await traceback_channel.send(f"```py\n{segment}```")
-            else:
-                await traceback_channel.send(f"```py\n{segment}```", embed=e)
-    except discord.Forbidden:
-        logging.error("Bot lacks permission to send messages in the traceback channel.")
-    except discord.HTTPException as http_error:
-        logging.error(f"Failed to send error message: {http_error}")
-    
+    # Send the traceback in segments to avoid hitting the Discord limit. One rejected message shouldn't take
+    # the rest of the batch down with it, but without permission to post there's no point trying the others.
+    for content, embeds in _pack_error_messages(payloads):
+        try:
+            await traceback_channel.send(content, embeds=embeds)
+        except discord.Forbidden:
+            logging.error("Bot lacks permission to send messages in the traceback channel.")
+            return
+        except discord.HTTPException as http_error:
+            logging.error(f"Failed to send error message: {http_error}")
+
+
+async def send_error_embed_internal(bot: discord.Client,
+                                    ctx_or_event: Union[commands.Context, discord.Interaction, str],
+                                    error: BaseException,
+                                    *args, **kwargs):
+    """Report an error right away, skipping error_reporter's queue and deduplication"""
+    segments, e = _build_error_report(bot, ctx_or_event, error, error_fingerprint(error), *args)
+    await _send_error_messages(bot, [(segment, None) for segment in segments[:-1]] + [(segments[-1], e)])
     print('')  # Empty print for spacing in logs
 
 
+def _error_log_entry(ctx_or_event: Union[commands.Context, discord.Interaction, str],
+                     error: BaseException,
+                     fingerprint: str,
+                     args: tuple) -> dict:
+    """The ErrorStore line describing one error. Only reads attributes, so it's cheap enough for submit()."""
+    entry = {'time': time.time(),
+             'timestamp': discord.utils.utcnow().isoformat(),
+             'fingerprint': fingerprint,
+             'type': f"{type(error).__module__}.{type(error).__qualname__}",
+             'message': str(error)[:500],
+             'command': None, 'source': None, 'guild_id': None, 'channel_id': None, 'user_id': None}
+
+    if isinstance(ctx_or_event, commands.Context):
+        entry['source'] = 'command'
+        entry['command'] = getattr(ctx_or_event.command, 'qualified_name', None)
+        entry['user_id'] = ctx_or_event.author.id
+    elif isinstance(ctx_or_event, discord.Interaction):
+        entry['source'] = 'interaction'
+        entry['command'] = getattr(ctx_or_event.command, 'qualified_name', None)
+        entry['user_id'] = ctx_or_event.user.id
+    else:
+        entry['source'] = 'event'
+        entry['command'] = str(ctx_or_event)
+
+    if isinstance(ctx_or_event, (commands.Context, discord.Interaction)):
+        entry['guild_id'] = ctx_or_event.guild.id if ctx_or_event.guild else None
+        entry['channel_id'] = ctx_or_event.channel.id if ctx_or_event.channel else None
+
+    for arg in args:
+        if isinstance(arg, discord.Message):
+            entry['guild_id'] = entry['guild_id'] or (arg.guild.id if arg.guild else None)
+            entry['channel_id'] = entry['channel_id'] or arg.channel.id
+            entry['user_id'] = entry['user_id'] or arg.author.id
+        else:
+            entry['guild_id'] = entry['guild_id'] or getattr(arg, 'guild_id', None)
+            entry['channel_id'] = entry['channel_id'] or getattr(arg, 'channel_id', None)
+            entry['user_id'] = entry['user_id'] or getattr(arg, 'author_id', None)
+    return entry
+
+
+class ErrorStore:
+    """Local JSON-lines log of every reported error, for when the error channel isn't enough (or isn't there).
+
+    append() only buffers an entry; flush() writes the buffer to `directory`/errors.jsonl and updates a small
+    index (errors_index.json) of hourly counts per fingerprint, so top_errors() doesn't need to scan the log.
+    The log is rotated to errors.jsonl.1 ... errors.jsonl.`backup_count` once it passes `max_bytes`, and
+    index counts older than `index_days` are pruned. flush() and the query methods do file I/O, so call them
+    from a thread when on the event loop."""
+    def __init__(self,
+                 directory: str = os.path.join(dir_path, 'error_logs'),
+                 max_bytes: int = 5_000_000,
+                 backup_count: int = 5,
+                 index_days: int = 30):
+        self.directory = directory
+        self.log_file = os.path.join(directory, 'errors.jsonl')
+        self.index_file = os.path.join(directory, 'errors_index.json')
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.index_days = index_days
+        self._buffer: list[dict] = []
+        self._index: Optional[dict[str, dict]] = None  # fingerprint: {'label', 'first_seen', 'last_seen', 'hours'}
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def append(self, entry: dict):
+        with self._buffer_lock:
+            self._buffer.append(entry)
+
+    def flush(self):
+        with self._buffer_lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+
+        with self._io_lock:
+            index = self._load_index()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as log_file:
+                log_file.writelines(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+                size = log_file.tell()
+            if size > self.max_bytes:
+                self._rotate()
+
+            for entry in entries:
+                self._index_entry(index, entry)
+            self._prune_index(index)
+            temp_file = f"{self.index_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as write_file:
+                json.dump(index, write_file, separators=(',', ':'))
+            os.replace(temp_file, self.index_file)
+
+    def _rotate(self):
+        for number in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.log_file}.{number}"):
+                os.replace(f"{self.log_file}.{number}", f"{self.log_file}.{number + 1}")
+        if self.backup_count:
+            os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+
+    @staticmethod
+    def _index_entry(index: dict, entry: dict):
+        stats = index.setdefault(entry['fingerprint'], {'label': None, 'first_seen': entry['time'], 'hours': {}})
+        stats['label'] = f"{entry['type'].rsplit('.', 1)[-1]}: {entry['message'][:100]} ({entry['command']})"
+        stats['last_seen'] = entry['time']
+        hour = str(int(entry['time'] // 3600))
+        stats['hours'][hour] = stats['hours'].get(hour, 0) + 1
+
+    def _prune_index(self, index: dict):
+        oldest_hour = int(time.time() // 3600) - self.index_days * 24
+        for fingerprint in list(index):
+            hours = index[fingerprint]['hours']
+            for hour in [hour for hour in hours if int(hour) < oldest_hour]:
+                del hours[hour]
+            if not hours:
+                del index[fingerprint]
+
+    def _load_index(self) -> dict:
+        if self._index is None:
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as read_file:
+                    self._index = json.load(read_file)
+            except FileNotFoundError:
+                self._index = self._build_index()
+            except json.decoder.JSONDecodeError:
+                logging.warning(f"Could not decode {self.index_file}, rebuilding it from the error log")
+                self._index = self._build_index()
+        return self._index
+
+    def _build_index(self) -> dict:
+        index = {}
+        for entry in self._iter_log_files():
+            self._index_entry(index, entry)
+        self._prune_index(index)
+        return index
+
+    def _iter_log_files(self):
+        # oldest rotated file first
+        paths = [f"{self.log_file}.{number}" for number in range(self.backup_count, 0, -1)] + [self.log_file]
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as read_file:
+                    for line in read_file:
+                        try:
+                            yield json.loads(line)
+                        except json.decoder.JSONDecodeError:
+                            continue  # partially written line from a crash
+            except FileNotFoundError:
+                continue
+
+    def iter_errors(self, since: Optional[datetime] = None):
+        """Every logged error (oldest first), optionally only those at or after `since`"""
+        self.flush()
+        since_time = since.timestamp() if since else 0
+        for entry in self._iter_log_files():
+            if entry['time'] >= since_time:
+                yield entry
+
+    def top_errors(self, since: datetime, limit: int = 10) -> list[dict]:
+        """The most frequent error fingerprints since `since` (to the hour), most frequent first.
+
+        Each result has 'fingerprint', 'count', 'label', 'first_seen' and 'last_seen' (Unix timestamps)."""
+        self.flush()
+        since_hour = int(since.timestamp() // 3600)
+        with self._io_lock:
+            index = self._load_index()
+            results = []
+            for fingerprint, stats in index.items():
+                count = sum(count for hour, count in stats['hours'].items() if int(hour) >= since_hour)
+                if count:
+                    results.append({'fingerprint': fingerprint, 'count': count, 'label': stats['label'],
+                                    'first_seen': stats['first_seen'], 'last_seen': stats['last_seen']})
+        results.sort(key=lambda result: result['count'], reverse=True)
+        return results[:limit]
+
+
+class _ErrorRecord:
+    """An error waiting in ErrorReporter's queue"""
+    __slots__ = ('bot', 'ctx_or_event', 'error', 'args', 'fingerprint', 'created_at')
+
+    def __init__(self, bot, ctx_or_event, error, args, fingerprint):
+        self.bot = bot
+        self.ctx_or_event = ctx_or_event
+        self.error = error
+        self.args = args
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+
+
+class ErrorReporter:
+    """Reports errors to the traceback channel from a single background worker.
+
+    submit() only fingerprints an error and appends it to a bounded queue, so it's cheap to call from failing
+    tasks and callbacks. Repeats of a recent error are counted by the ErrorRateLimiter instead of queued. When
+    the queue is full the oldest report is dropped, and the number of drops is mentioned in the next batch.
+
+    The worker formats up to `batch_size` errors at a time, packs their messages together where they fit, and
+    posts the rate limiter's summaries when they're due. close() reports whatever is left (call it on shutdown).
+
+    If a `store` is given, every submitted error (repeats included) is also written to it by the worker.
+    """
+    def __init__(self,
+                 maxsize: int = 200,
+                 batch_size: int = 20,
+                 rate_limiter: Optional[ErrorRateLimiter] = None,
+                 store: Optional[ErrorStore] = None):
+        self.queue: deque[_ErrorRecord] = deque(maxlen=maxsize)
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter or ErrorRateLimiter()
+        self.store = store
+        self.dropped = 0
+        self._bot: Optional[discord.Client] = None
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def submit(self,
+               bot: discord.Client,
+               ctx_or_event: Union[commands.Context, discord.Interaction, str],
+               error: BaseException,
+               *args) -> bool:
+        """Queue an error to be reported. Returns False if it was a repeat and only counted."""
+        fingerprint = error_fingerprint(error)
+        if self.store:
+            self.store.append(_error_log_entry(ctx_or_event, error, fingerprint, args))
+            self._wakeup.set()
+            self.start()
+        if not self.rate_limiter.hit(fingerprint, f"{error.__class__.__name__}: {str(error)[:100]}"):
+            logging.debug(f"Suppressed repeat of error {fingerprint}")
+            return False
+
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1  # deque(maxlen=...) drops the oldest record on append
+        self.queue.append(_ErrorRecord(bot, ctx_or_event, error, args, fingerprint))
+        self._bot = bot
+        self._wakeup.set()
+        self.start()
+        return True
+
+    def start(self):
+        """Start the worker if it isn't running. Does nothing outside the event loop; submit() will try again."""
+        if self._worker and not self._worker.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._closing = False
+        self._worker = asyncio.create_task(self._run(), name="ErrorReporter")
+
+    async def _run(self):
+        while not self._closing:
+            next_due = self.rate_limiter.next_due()
+            timeout = None if next_due is None else max(next_due - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._report_pending(self.rate_limiter.pop_due_summaries())
+                if self.store and self.store.pending:
+                    await asyncio.to_thread(self.store.flush)
+            except Exception as e:
+                exc = ''.join(traceback.format_exception(type(e), e, e.__traceback__, chain=False))
+                logging.error(f"Error in ErrorReporter: {exc}")
+
+    async def _report_pending(self, summaries: list[tuple[str, str, int]]):
+        while self.queue:
+            payloads = []
+            if self.dropped:
+                payloads.append((f"Dropped {self.dropped} error report(s) because the error queue was full.", None))
+                self.dropped = 0
+
+            for _ in range(min(self.batch_size, len(self.queue))):
+                record = self.queue.popleft()
+                try:
+                    segments, e = _build_error_report(record.bot, record.ctx_or_event, record.error,
+                                                      record.fingerprint, *record.args)
+                except Exception as build_error:
+                    exc = ''.join(traceback.format_exception(type(build_error), build_error,
+                                                             build_error.__traceback__, chain=False))
+                    logging.error(f"Error in send_error_embed: {exc}")
+                    continue
+                payloads.extend((segment, None) for segment in segments[:-1])
+                payloads.append((segments[-1], e))
+
+            if payloads:
+                await _send_error_messages(self._bot, payloads)
+
+        if summaries and self._bot:
+            minutes = round(self.rate_limiter.window / 60)
+            await _send_error_messages(self._bot, [
+                (f"`{fingerprint}` {label}: x{count} in the last {minutes} minutes", None)
+                for fingerprint, label, count in summaries])
+
+    async def close(self):
+        """Stop the worker and report everything still queued, including pending repeat summaries.
+
+        The worker is allowed to finish the batch it's sending, so records it already took off the queue aren't lost."""
+        if self._worker:
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self._report_pending(self.rate_limiter.flush())
+        if self.store:
+            await asyncio.to_thread(self.store.flush)
+
+
+error_store = ErrorStore()
+error_reporter = ErrorReporter(store=error_store)
+
+
+class LoopStall(Exception):
+    """Reported by LoopLagMonitor when the event loop was blocked for too long. `stack` is where it was blocked,
+    and `site` the frame of our own code responsible (see _stall_site()), if any."""
+    def __init__(self, message: str, stack: traceback.StackSummary, site: Optional[traceback.FrameSummary] = None):
+        super().__init__(message)
+        self.stack = stack
+        self.site = site
+
+
+def _stall_site(stack: traceback.StackSummary) -> Optional[traceback.FrameSummary]:
+    """The innermost BotUtils or cog frame of a blocked stack, or failing that the innermost frame outside the
+    standard library and installed packages. A stack is sampled at a random moment of a stall, so this is the
+    part that stays the same when the same code blocks the loop again."""
+    import sysconfig
+    library_paths = tuple(os.path.realpath(path) + os.sep for path in {
+        sysconfig.get_paths()['stdlib'], sysconfig.get_paths()['purelib'], sysconfig.get_paths()['platlib']})
+    own_code = [frame for frame in stack if not os.path.realpath(frame.filename).startswith(library_paths)
+                and not frame.filename.startswith('<')]
+    for frame in reversed(own_code):
+        if os.path.basename(frame.filename) == os.path.basename(__file__) or \
+                f"{os.sep}cogs{os.sep}" in frame.filename:
+            return frame
+    return own_code[-1] if own_code else None
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs things, and catches the code responsible when it's blocked.
+
+    A sentinel task wakes up every `interval` seconds; how late it wakes up is the loop lag, counted in a
+    fixed-bucket histogram. A watchdog thread checks that the sentinel keeps waking up, and if it's more than
+    `threshold` seconds overdue grabs the stack of the event loop's thread, i.e. the code blocking it. When the
+    loop recovers the stall is sent to error_reporter as a LoopStall, naming the innermost BotUtils frame if there
+    is one. While the loop is healthy this costs one short task wakeup and one thread wakeup per interval."""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # upper bounds in seconds
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5, reporter: Optional[ErrorReporter] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.reporter = reporter
+        self.histogram = [0] * (len(self.BUCKETS) + 1)  # last bucket is > BUCKETS[-1]
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._next_tick = 0.0
+        self._captured: Optional[tuple[float, traceback.StackSummary]] = None  # (next_tick, stack)
+        self._sentinel: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start monitoring the running event loop. Does nothing if already started or outside the event loop."""
+        if self._sentinel and not self._sentinel.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._stop.set()  # a watchdog thread left over from a previous run
+        self._stop = threading.Event()
+        self._next_tick = time.perf_counter() + self.interval
+        self._sentinel = asyncio.create_task(self._run_sentinel(), name="LoopLagMonitor")
+        self._watchdog = threading.Thread(target=self._run_watchdog, args=(threading.get_ident(), self._stop),
+                                          name="LoopLagMonitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sentinel:
+            self._sentinel.cancel()
+            self._sentinel = None
+
+    async def _run_sentinel(self):
+        while True:
+            self._next_tick = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - self._next_tick, 0.0)
+            self.samples += 1
+            self.histogram[bisect.bisect_left(self.BUCKETS, lag)] += 1
+            self.max_lag = max(self.max_lag, lag)
+
+            captured, self._captured = self._captured, None
+            if lag >= self.threshold and captured:
+                self.stalls += 1
+                self._report(lag, captured[1])
+
+    def _run_watchdog(self, loop_thread_id: int, stop: threading.Event):
+        while not stop.wait(self.threshold / 2):
+            next_tick = self._next_tick
+            if time.perf_counter() - next_tick < self.threshold:
+                continue
+            if self._captured and self._captured[0] == next_tick:
+                continue  # already have the stack for this stall
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is not None:
+                self._captured = (next_tick, traceback.extract_stack(frame))
+            del frame
+
+    def _report(self, lag: float, stack: traceback.StackSummary):
+        message = f"Event loop was blocked for {lag:.2f}s"
+        site = _stall_site(stack)
+        if site:
+            message += f" in {os.path.basename(site.filename)} {site.name}() (line {site.lineno})"
+        stall = LoopStall(f"{message}. Blocking stack:\n{''.join(stack.format())}", stack, site)
+        logging.warning(message)
+        (self.reporter or error_reporter).submit(here.bot, "event loop stall", stall)
+
+    def metrics(self) -> dict:
+        """Lag histogram ({upper bound: count}, with "+Inf" for the rest) and totals"""
+        bounds = [str(bound) for bound in self.BUCKETS] + ["+Inf"]
+        return {'histogram': dict(zip(bounds, self.histogram)), 'samples': self.samples,
+                'max_lag': self.max_lag, 'stalls': self.stalls}
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
 # async def send_error_embed(bot: discord.Client,
 #                            ctx: Union[commands.Context, discord.Interaction],
 #                            error: Exception,
@@ -772,7 +2276,8 @@ async def _aiohttp_get_base(
         url: str,
         headers: dict = None,
         params: dict = None
-) -> AsyncIterator[aiohttp.ClientResponse]:
+) -> AsyncIterator['aiohttp.ClientResponse']:
+    import aiohttp
     if isinstance(url, commands.Context):
         raise ValueError("You passed a context instead of a URL")
 
@@ -782,6 +2287,7 @@ async def _aiohttp_get_base(
             yield resp
 
 
+@instrumented
 async def aiohttp_get_bytes(url: str, headers: dict = None, params: dict = None) -> bytes:
     """Any non-200 / 200x status code returns aiohttp.ClientResponseError"""
     async with _aiohttp_get_base(url, headers, params) as resp:
@@ -793,6 +2299,7 @@ async def _aiohttp_fetch_text(url: str, headers: dict = None, params: dict = Non
         return await resp.text()
 
 
+@instrumented
 async def aiohttp_get_json(url: str, headers: dict = None, params: dict = None) -> dict | list | Any:
     """Any non-200 / 200x status code returns aiohttp.ClientResponseError"""
     async with _aiohttp_get_base(url, headers, params) as resp:
@@ -800,12 +2307,14 @@ async def aiohttp_get_json(url: str, headers: dict = None, params: dict = None)
         # https://docs.python.org/3/library/json.html#json.JSONDecoder
 
 
+@instrumented
 async def aiohttp_get_text(
         url: str,
         ctx: commands.Context = None,
         headers: dict = None,
         params: dict = None) -> str:
     """Any non-200 / 200x status code returns aiohttp.ClientResponseError"""
+    import aiohttp
     try:
         text = await _aiohttp_fetch_text(url, headers=headers, params=params)
         
@@ -840,7 +2349,231 @@ async def aiohttp_get_text(
             raise ValueError("I received nothing from the site for your search query.")
 
 
+class ExecutorPool:
+    """A named, lazily created thread or process pool that counts what goes through it"""
+    def __init__(self, name: str, kind: str, max_workers: int):
+        if kind not in ('thread', 'process'):
+            raise ValueError("kind must be 'thread' or 'process'")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_pending = 0
+        self.total_seconds = 0.0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def pending(self) -> int:
+        """Jobs submitted but not finished yet (queued or running)"""
+        return self.submitted - self.completed - self.failed
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"BotUtils-{self.name}")
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(self.max_workers)
+        return self._executor
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run func(*args, **kwargs) in this pool. For process pools, func and its arguments must be picklable."""
+        loop = asyncio.get_running_loop()
+        self.submitted += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return result
+        finally:
+            self.total_seconds += time.perf_counter() - start
+
+    def metrics(self) -> dict:
+        return {'kind': self.kind, 'max_workers': self.max_workers, 'submitted': self.submitted,
+                'completed': self.completed, 'failed': self.failed, 'pending': self.pending,
+                'peak_pending': self.peak_pending, 'total_seconds': self.total_seconds}
+
+    def shutdown(self, wait: bool = True, cancel_futures: Optional[bool] = None):
+        """Shut the executor down; it's recreated on the next job. Unless told otherwise, queued jobs are
+        cancelled only when not waiting for them."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait if cancel_futures is None else cancel_futures)
+            self._executor = None
+
+
+class ExecutorPools:
+    """The executors BotUtils runs blocking work in, so it doesn't all compete in the default thread pool:
+
+    - 'io': blocking file/network calls (the default for sync functions passed to asyncio_task())
+    - 'serialization': JSON encoding and writing for dump_json()
+    - 'cpu': a process pool for CPU-bound batch work, like jpenratio_many()
+
+    Resize a pool with configure(); the new size takes effect for the next job, while jobs already queued finish
+    in the old executor. All pools are shut down at exit."""
+    def __init__(self):
+        self.pools: dict[str, ExecutorPool] = {
+            'io': ExecutorPool('io', 'thread', 8),
+            'serialization': ExecutorPool('serialization', 'thread', 2),
+            'cpu': ExecutorPool('cpu', 'process', max(1, (os.cpu_count() or 2) - 1)),
+        }
+
+    def __getitem__(self, name: str) -> ExecutorPool:
+        try:
+            return self.pools[name]
+        except KeyError:
+            raise ValueError(f"Unknown executor '{name}', must be one of {', '.join(self.pools)}") from None
+
+    def configure(self, name: str, max_workers: int):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        pool = self[name]
+        pool.shutdown(wait=False, cancel_futures=False)  # retire the old executor once its queue drains
+        pool.max_workers = max_workers
+
+    async def run(self, name: str, func: Callable, *args, **kwargs):
+        return await self[name].run(func, *args, **kwargs)
+
+    def metrics(self) -> dict[str, dict]:
+        return {name: pool.metrics() for name, pool in self.pools.items()}
+
+    def shutdown(self, wait: bool = True):
+        for pool in self.pools.values():
+            pool.shutdown(wait=wait)
+
+
+executor_pools = ExecutorPools()
+atexit.register(executor_pools.shutdown)
+
+
+class _TaskInfo:
+    """Bookkeeping for one task started through TaskRegistry"""
+    __slots__ = ('name', 'group', 'queued_at', 'started_at', 'finished_at', 'state')
+
+    def __init__(self, name: str, group: str):
+        self.name = name
+        self.group = group
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.state = 'queued'  # queued -> running -> done / failed / cancelled
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'group': self.group, 'state': self.state, 'queued_at': self.queued_at,
+                'started_at': self.started_at, 'finished_at': self.finished_at, 'duration': self.duration}
+
+
+class TaskRegistry:
+    """Keeps track of every task started by asyncio_task().
+
+    Tasks belong to a group (asyncio_task(..., task_group="name"), "default" otherwise). set_group_limit() caps how
+    many tasks of a group run at once; tasks over the limit are created right away but wait their turn before
+    starting. Finished tasks are kept in `history` (the last `history_size` of them) with their timings.
+
+    Call drain() on shutdown or before reloading a cog to let its tasks finish (or cancel them)."""
+    def __init__(self, history_size: int = 200):
+        self.tasks: dict[asyncio.Task, _TaskInfo] = {}
+        self.history: deque[_TaskInfo] = deque(maxlen=history_size)
+        self._limits: dict[str, asyncio.Semaphore] = {}
+
+    def set_group_limit(self, group: str, limit: Optional[int]):
+        """Allow at most `limit` tasks of `group` to run at the same time (None removes the limit).
+
+        Tasks that already started keep their place under the old limit."""
+        if limit is None:
+            self._limits.pop(group, None)
+        elif limit < 1:
+            raise ValueError("limit must be at least 1")
+        else:
+            self._limits[group] = asyncio.Semaphore(limit)
+
+    def create_task(self, coro, name: str, group: str = 'default') -> asyncio.Task:
+        info = _TaskInfo(name, group)
+        task = asyncio.create_task(self._run(coro, info), name=name)
+        self.tasks[task] = info
+        task.add_done_callback(self._on_done)
+        return task
+
+    async def _run(self, coro, info: _TaskInfo):
+        semaphore = self._limits.get(info.group)
+        try:
+            if semaphore:
+                await semaphore.acquire()
+        except asyncio.CancelledError:
+            coro.close()  # never started; avoids a "coroutine was never awaited" warning
+            raise
+        try:
+            info.state = 'running'
+            info.started_at = time.time()
+            return await coro
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    def _on_done(self, task: asyncio.Task):
+        info = self.tasks.pop(task, None)
+        if info is None:
+            return
+        info.finished_at = time.time()
+        if task.cancelled():
+            info.state = 'cancelled'
+        elif task.exception():
+            info.state = 'failed'
+        else:
+            info.state = 'done'
+        self.history.append(info)
+
+    def live_counts(self) -> dict[str, dict[str, int]]:
+        """{group: {'running': n, 'queued': n}} for every group with live tasks"""
+        counts = {}
+        for info in self.tasks.values():
+            group_counts = counts.setdefault(info.group, {'running': 0, 'queued': 0})
+            group_counts['running' if info.state == 'running' else 'queued'] += 1
+        return counts
+
+    def live_tasks(self, *, name: Optional[str] = None, group: Optional[str] = None) -> list[asyncio.Task]:
+        return [task for task, info in self.tasks.items()
+                if (name is None or info.name == name) and (group is None or info.group == group)]
+
+    async def drain(self, group: Optional[str] = None, timeout: Optional[float] = 30) -> int:
+        """Wait up to `timeout` seconds for live tasks (of one group, or all) to finish, then cancel the rest.
+
+        Returns the number of tasks that had to be cancelled."""
+        current = asyncio.current_task()
+        tasks = [task for task in self.live_tasks(group=group) if task is not current]
+        if not tasks:
+            return 0
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        return len(pending)
+
+
+task_registry = TaskRegistry()
+
+
 def asyncio_task(func: Callable, *args, **kwargs):
+    """Run func(*args, **kwargs) as a task tracked by task_registry. Errors are sent to the error channel.
+
+    Optional keyword arguments (not passed on to func):
+    - task_name: defaults to func.__qualname__
+    - task_group: the task_registry group, for concurrency limits and drain()
+    - executor: for sync functions, the executor_pools pool to run it in ('io' by default)"""
     if not isinstance(func, Callable):
         raise ValueError("The first argument must be a callable function.")
     
@@ -849,53 +2582,103 @@ def asyncio_task(func: Callable, *args, **kwargs):
         del kwargs["task_name"]
     else:
         task_name = func.__qualname__
+    task_group = kwargs.pop("task_group", 'default')
+    executor = kwargs.pop("executor", None)
     
     if asyncio.iscoroutinefunction(func):
+        if executor:
+            raise ValueError("executor can only be used with sync functions.")
         coro = func(*args, **kwargs)  # Create coroutine
     else:
-        # If not a coroutine function, wrap it in an async function
-        async def wrapper():
-            return await asyncio.to_thread(func, *args, **kwargs)
-        
-        coro = wrapper()
+        # If not a coroutine function, run it in one of the executor pools
+        coro = executor_pools.run(executor or 'io', func, *args, **kwargs)
         
-    task = asyncio.create_task(coro, name=task_name)
-    task.set_name(task_name)
+    task = task_registry.create_task(coro, task_name, task_group)
     task.add_done_callback(asyncio_task_done_callback)
     return task
 
 def asyncio_task_done_callback(task: asyncio.Task):
     try:
-        coro_name = task.get_coro().__qualname__
+        coro_name = task.get_name()
         if task.exception():
             print(f"Error in {coro_name}: {task.exception()}")
-            asyncio_task(send_error_embed, here.bot, coro_name, task.exception())
+            error_reporter.submit(here.bot, coro_name, task.exception())
         else:
             pass
             # print(f"Task {coro_name} completed successfully.")
     except asyncio.CancelledError:
-        print(f"Task {task.get_coro().__qualname__} was cancelled.")
+        print(f"Task {task.get_name()} was cancelled.")
     except Exception as e:
         print(f"Unexpected error in task callback: {e}")
 
 
-def split_text_into_segments(text, segment_length=1024) -> list[str]:
-    """Split a long text into segments of a specified length."""
-    segments = []
-    if len(text) > 20_000:
-        logging.warning("Text length exceeds 20,000 characters, reducing to 20,000 for safety.")
-        text = text[:20_000]
-    while len(text) > segment_length:
-        # Find the last new line before the segment limit to avoid breaking words
-        split_index = text.rfind('\n', 0, segment_length)
-        if split_index == -1:  # If no new line is found, split at space
-            split_index = text.rfind(' ', 0, segment_length)
-            if split_index == -1:  # If no space is found, split at the limit
-                split_index = segment_length
-        segments.append(text[:split_index])
-        text = text[split_index:].lstrip()  # Remove leading spaces in the next segment
-    segments.append(text)  # Append the last segment
-    return segments
+_non_whitespace = re.compile(r'\S')
+_code_fence = re.compile(r'^```[^\s`]*', re.MULTILINE)
+
+
+def _find_split(text: str, start: int, end: int, markdown: bool) -> int:
+    """Where to end a segment that starts at `start` and may not go past `end`"""
+    if markdown:
+        # paragraph and sentence breaks are preferred, unless they would leave a very short segment
+        half = start + (end - start) // 2
+        split_index = text.rfind('\n\n', start, end)
+        if split_index > half:
+            return split_index
+        split_index = text.rfind('\n', start, end)
+        if split_index > half:
+            return split_index
+        split_index = text.rfind('. ', start, end)
+        if split_index > half:
+            return split_index + 1  # keep the period with its sentence
+    
+    # Find the last new line before the segment limit to avoid breaking words
+    split_index = text.rfind('\n', start, end)
+    if split_index == -1:  # If no new line is found, split at space
+        split_index = text.rfind(' ', start, end)
+        if split_index == -1:  # If no space is found, split at the limit
+            split_index = end
+    return split_index
+
+
+def iter_text_segments(text: str, segment_length: int = 1024, *, markdown: bool = False, code_fences: bool = False):
+    """Lazily split a long text into segments of at most segment_length characters.
+
+    Segments end at the last new line (or else the last space) that fits, and leading whitespace is dropped from
+    the next segment. The text is walked with offsets instead of being re-sliced, so this is linear in its length.
+
+    - markdown: prefer ending segments at blank lines, then new lines, then the end of a sentence
+    - code_fences: if a segment ends inside a ``` code block, close the block and reopen it (with the same
+      language) at the start of the next segment"""
+    closing = '\n```'
+    length = len(text)
+    position = 0
+    fence = None  # opening line ("```py") of a code block left open by the previous segment
+    while True:
+        prefix = f"{fence}\n" if fence else ''
+        if length - position <= segment_length - len(prefix):
+            yield prefix + text[position:]  # the last segment
+            return
+        
+        room = segment_length - len(prefix) - (len(closing) if code_fences else 0)
+        if room < 1:
+            raise ValueError("segment_length is too short to fit the code fences")
+        split_index = _find_split(text, position, position + room, markdown)
+        
+        if code_fences:
+            for match in _code_fence.finditer(text, position, split_index):
+                fence = None if fence else match.group(0)
+            yield prefix + text[position:split_index] + (closing if fence else '')
+        else:
+            yield text[position:split_index]
+        
+        # Remove leading whitespace in the next segment
+        next_text = _non_whitespace.search(text, split_index)
+        position = next_text.start() if next_text else length
+
+
+def split_text_into_segments(text, segment_length=1024, **kwargs) -> list[str]:
+    """Split a long text into segments of a specified length. See iter_text_segments() for the keyword options."""
+    return list(iter_text_segments(text, segment_length, **kwargs))
     
 
 class RaiModal(discord.ui.Modal):
@@ -0,0 +1,174 @@
+# benchmark the hot paths of cogs.utils.BotUtils.bot_utils on synthetic data
+#
+# Runs offline: guilds and members are SimpleNamespace stand-ins, and the database benchmarks write to a temp dir.
+#
+#   python -m cogs.utils.BotUtils.tests.bench_bot_utils                          # print results
+#   python -m cogs.utils.BotUtils.tests.bench_bot_utils --save baseline.json     # save a baseline
+#   python -m cogs.utils.BotUtils.tests.bench_bot_utils --compare baseline.json  # exit 1 on regressions
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from unittest import mock
+
+from cogs.utils.BotUtils import bot_utils
+
+EN_WORDS = ["hello", "thanks", "what", "does", "this", "mean", "study", "every", "day", "grammar", "lol", "nice"]
+JP_WORDS = ["こんにちは", "ありがとう", "勉強", "毎日", "日本語", "難しい", "です", "ます", "カタカナ", "漢字"]
+EMOJI = ["😀", "😂", "👍", "🔥", "🎉", "❤️", "🙏", "😭"]
+
+TRACEBACK = """Traceback (most recent call last):
+  File "/home/pi/Documents/bot-venv/lib/python3.11/site-packages/discord/client.py", line 449, in _run_event
+    await coro(*args, **kwargs)
+  File "/home/pi/Documents/Rai/cogs/logger.py", line 586, in on_raw_message_edit
+    await self.log_raw_payload(payload)
+  File "/home/pi/Documents/Rai/cogs/utils/BotUtils/bot_utils.py", line 153, in safe_send
+    return await destination.send(content, embed=embed, delete_after=delete_after, file=file, view=view)
+           ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+discord.errors.HTTPException: 400 Bad Request (error code: 50035): Invalid Form Body
+"""
+
+
+def make_corpus(rng: random.Random, count: int = 5000) -> list[str]:
+    """Chat-like messages: mostly English, mostly Japanese or mixed, some with URLs and custom emoji"""
+    messages = []
+    for _ in range(count):
+        style = rng.random()
+        words = []
+        for _ in range(rng.randint(3, 30)):
+            if style < 0.4 or (style < 0.7 and rng.random() < 0.3):
+                words.append(rng.choice(EN_WORDS))
+            else:
+                words.append(rng.choice(JP_WORDS))
+        if rng.random() < 0.1:
+            words.append("https://example.com/some/path?q=1")
+        if rng.random() < 0.1:
+            words.append(f"<:pepe:{rng.randint(10 ** 17, 10 ** 18)}>")
+        messages.append(" ".join(words))
+    return messages
+
+
+def make_emoji_spam(rng: random.Random, count: int = 200) -> list[str]:
+    return ["".join(rng.choice(EMOJI) for _ in range(200)) + " spam " +
+            " ".join(f"<:e{i}:{rng.randint(10 ** 17, 10 ** 18)}>" for i in range(20)) for _ in range(count)]
+
+
+def make_guild(rng: random.Random, member_count: int = 100_000) -> types.SimpleNamespace:
+    members = []
+    for i in range(member_count):
+        name = f"user{i}_{rng.choice(EN_WORDS)}"
+        nick = f"{rng.choice(JP_WORDS)}{i}" if rng.random() < 0.3 else None
+        members.append(types.SimpleNamespace(id=10 ** 17 + i, name=name, nick=nick, display_name=nick or name))
+    guild = types.SimpleNamespace(members=members)
+    guild.get_member = {member.id: member for member in members}.get
+    return guild
+
+
+def make_db(rng: random.Random, guild_count: int = 50, users_per_guild: int = 1000) -> dict:
+    """A database of a few MB, shaped like nested per-guild settings"""
+    return {str(10 ** 17 + g): {'users': {str(10 ** 17 + u): {'warnings': rng.randint(0, 5),
+                                                              'roles': [rng.randint(10 ** 17, 10 ** 18)
+                                                                        for _ in range(3)],
+                                                              'note': rng.choice(EN_WORDS) * 3}
+                                          for u in range(users_per_guild)},
+                                'enable': True}
+            for g in range(guild_count)}
+
+
+def measure(func, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+
+def run_benchmarks(repeat: int = 5, quick: bool = False) -> dict:
+    rng = random.Random(0)
+    scale = 10 if quick else 1
+    corpus = make_corpus(rng, 5000 // scale)
+    emoji_spam = make_emoji_spam(rng, 200 // scale)
+    guild = make_guild(rng, 100_000 // scale)
+    db = make_db(rng, 50 // scale)
+    long_traceback = TRACEBACK * 500
+    results = {}
+
+    results['get_character_spread'] = measure(lambda: [bot_utils.get_character_spread(m) for m in corpus], repeat)
+    results['jpenratio'] = measure(lambda: [bot_utils.jpenratio(m) for m in corpus], repeat)
+    results['rem_emoji_url'] = measure(lambda: [bot_utils.rem_emoji_url(m) for m in emoji_spam], repeat)
+    results['split_text_into_segments'] = measure(
+        lambda: bot_utils.split_text_into_segments(long_traceback, 1900), repeat)
+
+    # member_converter looks up the most active members through helper_functions, which needs a running bot
+    helper_functions = types.ModuleType('cogs.utils.helper_functions')
+    helper_functions.get_top_server_members_activity = lambda g: g.members[:50]
+    ctx = types.SimpleNamespace(guild=guild)
+    loop = asyncio.new_event_loop()
+    try:
+        with mock.patch.dict(sys.modules, {'cogs.utils.helper_functions': helper_functions}):
+            for label, query in [('id', str(guild.members[-1].id)),
+                                 ('prefix', guild.members[-1].name),
+                                 ('missing', 'no such member')]:
+                results[f'member_converter_{label}'] = measure(
+                    lambda: loop.run_until_complete(bot_utils.member_converter(ctx, query)), repeat)
+    finally:
+        loop.close()
+
+    with tempfile.TemporaryDirectory() as temp_dir, mock.patch.object(bot_utils, 'dir_path', temp_dir):
+        results['_write_json_dump'] = measure(lambda: bot_utils._write_json_dump('db', db), repeat)
+        bot = types.SimpleNamespace()
+        results['load_db'] = measure(lambda: bot_utils.load_db(bot, 'db'), repeat)
+
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'benchmarks': results}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.25) -> list[str]:
+    """Benchmarks whose best time got more than `threshold` (25% by default) slower than the baseline"""
+    regressions = []
+    for name, result in current['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old and result['min'] > old['min'] * (1 + threshold):
+            regressions.append(f"{name}: {old['min'] * 1000:.2f}ms -> {result['min'] * 1000:.2f}ms "
+                               f"({result['min'] / old['min'] - 1:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark BotUtils hot paths")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help="use 10x smaller fixtures")
+    parser.add_argument('--save', metavar='PATH', help="save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare against a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown before flagging (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat, args.quick)
+    for name, result in results['benchmarks'].items():
+        print(f"{name:<30} min {result['min'] * 1000:9.2f}ms   median {result['median'] * 1000:9.2f}ms")
+
+    if args.save:
+        with open(args.save, 'w') as write_file:
+            json.dump(results, write_file, indent=4)
+
+    if args.compare:
+        with open(args.compare) as read_file:
+            baseline = json.load(read_file)
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            print("\n".join(regressions))
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
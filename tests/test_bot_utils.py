@@ -1,7 +1,27 @@
 # test some functions in cogs.utils.helper_functions.py using unittest
 
+import asyncio
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import types
 import unittest
-from cogs.utils.BotUtils.bot_utils import split_text_into_segments
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import discord
+from discord.ext import commands
+
+from cogs.utils.BotUtils.bot_utils import split_text_into_segments, iter_text_segments, LanguageRatioAggregator, ErrorRateLimiter, \
+    error_fingerprint, ErrorReporter, _pack_error_messages, _send_error_messages, ErrorStore, TaskRegistry, ExecutorPools, jpenratio, \
+    jpenratio_many, LoopLagMonitor, instrumentation, instrumented, safe_git_pull, _source_hash, MessageQueueStore, \
+    StatsRollup, sum_stats, LoopStall, _stall_site, reload_changed_extensions
+from cogs.utils.BotUtils.tests.bench_bot_utils import compare_results
 
 
 class TestSplitText(unittest.TestCase):
@@ -77,6 +97,663 @@ In embeds.0.footer.icon_url: Not a well formed URL.""")
         # split every 500
         self.assertEqual(split_text_into_segments(s, 500), result)
 
+    def test_no_length_cap(self):
+        """Long texts should be split in full instead of being cut off at 20,000 characters."""
+        segments = split_text_into_segments("word " * 10_000, 1000)
+        self.assertEqual(sum(len(segment.split()) for segment in segments), 10_000)
+
+    def test_lazy(self):
+        """iter_text_segments() should be a generator yielding the same segments."""
+        segments = iter_text_segments("a" * 2500, 1024)
+        self.assertEqual(next(segments), "a" * 1024)
+        self.assertEqual(list(segments), ["a" * 1024, "a" * 452])
+
+    def test_code_fences(self):
+        """A code block cut in two should be closed and reopened with its language."""
+        text = "```py\n" + "\n".join(f"x = {i}" for i in range(20)) + "\n```\ndone"
+        segments = split_text_into_segments(text, 60, code_fences=True)
+        self.assertTrue(all(len(segment) <= 60 for segment in segments))
+        self.assertTrue(segments[0].startswith("```py\n") and segments[0].endswith("\n```"))
+        self.assertTrue(segments[1].startswith("```py\nx = "))
+        self.assertTrue(segments[-1].endswith("```\ndone"))
+
+    def test_markdown_prefers_paragraphs(self):
+        text = "First paragraph line one\nline two\n\nSecond paragraph"
+        self.assertEqual(split_text_into_segments(text, 40, markdown=True),
+                         ["First paragraph line one\nline two", "Second paragraph"])
+
+
+class TestLanguageRatioAggregator(unittest.TestCase):
+    """Test the rolling per-user/per-channel English/CJK ratio windows."""
+
+    def test_message_window_rolls_over(self):
+        """Only the last window_size messages should count towards the ratio."""
+        aggregator = LanguageRatioAggregator(window_size=2)
+        aggregator.add(1, 10, 0, 10, timestamp=0)
+        aggregator.add(1, 10, 10, 0, timestamp=0)
+        self.assertEqual(aggregator.user_ratio(1), 0.5)
+        aggregator.add(1, 10, 10, 0, timestamp=0)
+        self.assertEqual(aggregator.user_ratio(1), 1.0)
+        self.assertEqual(aggregator.channel_ratio(10), 1.0)
+
+    def test_time_buckets_expire(self):
+        """Buckets older than bucket_count * bucket_seconds should be ignored."""
+        aggregator = LanguageRatioAggregator(bucket_count=2, bucket_seconds=10)
+        aggregator.add(1, None, 0, 5, timestamp=0)
+        aggregator.add(1, None, 5, 0, timestamp=15)
+        self.assertEqual(aggregator.user_ratio(1, by_time=True, now=15), 0.5)
+        self.assertEqual(aggregator.user_ratio(1, by_time=True, now=25), 1.0)
+        self.assertIsNone(aggregator.user_ratio(1, by_time=True, now=100))
+
+    def test_out_of_order_timestamp(self):
+        """A backfilled message from before the window shouldn't reset the bucket it shares a slot with."""
+        aggregator = LanguageRatioAggregator()
+        now = 100 * 3600
+        aggregator.add(1, None, 10, 0, timestamp=now)
+        aggregator.add(1, None, 0, 10, timestamp=now - 24 * 3600)
+        self.assertEqual(aggregator.user_ratio(1, by_time=True, now=now), 1.0)
+        self.assertEqual(aggregator.user_ratio(1), 0.5)
+
+    def test_max_keys_evicts_least_recent(self):
+        aggregator = LanguageRatioAggregator(max_keys=2)
+        aggregator.add(1, None, 1, 0)
+        aggregator.add(2, None, 1, 0)
+        aggregator.add(1, None, 1, 0)
+        aggregator.add(3, None, 1, 0)
+        self.assertEqual(list(aggregator.users), [1, 3])
+
+    def test_round_trip(self):
+        """to_dict()/from_dict() should preserve the windows and their totals."""
+        aggregator = LanguageRatioAggregator(window_size=3)
+        aggregator.add(1, 10, 3, 1, timestamp=0)
+        aggregator.add(2, 10, 0, 4, timestamp=0)
+        restored = LanguageRatioAggregator.from_dict(aggregator.to_dict())
+        self.assertEqual(restored.user_ratio(1), 0.75)
+        self.assertEqual(restored.channel_ratio(10), 0.375)
+        self.assertEqual(restored.to_dict(), aggregator.to_dict())
+
+    def test_dump_is_compact(self):
+        """Only filled message slots and used buckets should be saved, as packed arrays."""
+        aggregator = LanguageRatioAggregator(window_size=3)
+        for i in range(5):
+            aggregator.add(1, None, i + 1, 1, timestamp=i * 3600)
+        for user_id in range(2, 1000):
+            aggregator.add(user_id, None, 10, 3, timestamp=0)
+        data = aggregator.to_dict()
+        self.assertLess(len(json.dumps(data, indent=4)), 250_000)
+
+        restored = LanguageRatioAggregator.from_dict(json.loads(json.dumps(data)))
+        self.assertEqual(restored.user_ratio(1), 12 / 15)  # the last three messages: 3+4+5 English, 3 CJK
+        self.assertEqual(restored.user_ratio(1, by_time=True, now=4 * 3600), 15 / 20)
+        restored.add(1, None, 0, 6, timestamp=5 * 3600)  # overwrites the oldest kept message (3, 1)
+        self.assertEqual(restored.user_ratio(1), 9 / 17)
+
+
+def _raise_value_error(text):
+    raise ValueError(text)
+
+
+class TestErrorFingerprinting(unittest.TestCase):
+    """Test grouping repeated errors by fingerprint and rate limiting their reports."""
+
+    @staticmethod
+    def _catch(func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            return e
+
+    def test_same_site_same_fingerprint(self):
+        """The message of an exception shouldn't change its fingerprint, but the type should."""
+        first = self._catch(_raise_value_error, "a")
+        second = self._catch(_raise_value_error, "b")
+        self.assertEqual(error_fingerprint(first), error_fingerprint(second))
+        self.assertNotEqual(error_fingerprint(first), error_fingerprint(self._catch(int, None)))
+
+    def test_repeats_are_summarized(self):
+        limiter = ErrorRateLimiter(window=600)
+        self.assertTrue(limiter.hit("abc", "ValueError: a", now=0))
+        for _ in range(311):
+            self.assertFalse(limiter.hit("abc", "ValueError: a", now=10))
+        self.assertEqual(limiter.pop_due_summaries(now=300), [])
+        self.assertEqual(limiter.pop_due_summaries(now=600), [("abc", "ValueError: a", 311)])
+
+        # the storm continues: still suppressed in the new window
+        self.assertFalse(limiter.hit("abc", "ValueError: a", now=700))
+        self.assertEqual(limiter.pop_due_summaries(now=1200), [("abc", "ValueError: a", 1)])
+
+        # a quiet window forgets the fingerprint, so the next occurrence is sent in full again
+        self.assertEqual(limiter.pop_due_summaries(now=1800), [])
+        self.assertIsNone(limiter.next_due())
+        self.assertTrue(limiter.hit("abc", "ValueError: a", now=1900))
+
+
+class TestErrorReporter(unittest.TestCase):
+    """Test the bounded error queue and the packing of report messages."""
+
+    def test_queue_drops_oldest(self):
+        """Outside an event loop submit() only queues, and a full queue drops its oldest record."""
+        reporter = ErrorReporter(maxsize=2, rate_limiter=ErrorRateLimiter(window=0))  # window=0: no dedup
+        for text in "abc":
+            try:
+                _raise_value_error(text)
+            except ValueError as e:
+                self.assertTrue(reporter.submit(None, "on_message", e))
+        self.assertEqual([str(record.error) for record in reporter.queue], ["b", "c"])
+        self.assertEqual(reporter.dropped, 1)
+
+    def test_pack_messages(self):
+        embeds = [_SizedEmbed(100) for _ in range(3)]
+        packed = _pack_error_messages([("a" * 1500, None), ("b" * 400, embeds[0]),
+                                       ("c" * 200, embeds[1]), ("d", embeds[2])])
+        self.assertEqual(packed, [("a" * 1500 + "\n" + "b" * 400, [embeds[0]]),
+                                  ("c" * 200 + "\nd", [embeds[1], embeds[2]])])
+
+    def test_pack_messages_embed_total(self):
+        """The embeds in one message shouldn't add up to more than 6000 characters."""
+        embeds = [_SizedEmbed(2030) for _ in range(5)]
+        packed = _pack_error_messages([("x", embed) for embed in embeds])
+        self.assertEqual([len(message_embeds) for _, message_embeds in packed], [2, 2, 1])
+
+    def test_failed_message_does_not_drop_batch(self):
+        channel = _FakeChannel(fail_first=True)
+        bot = types.SimpleNamespace(get_channel=lambda channel_id: channel)
+        with mock.patch.dict(os.environ, {'ERROR_CHANNEL_ID': '1'}):
+            asyncio.run(_send_error_messages(bot, [("a" * 1500, None), ("b" * 1500, None)]))
+        self.assertEqual(channel.sent, ["b" * 1500])
+
+    def test_close_finishes_current_batch(self):
+        """close() shouldn't lose records the worker already took off the queue."""
+        channel = _FakeChannel()
+        bot = types.SimpleNamespace(get_channel=lambda channel_id: channel)
+
+        async def report():
+            reporter = ErrorReporter(batch_size=1, rate_limiter=ErrorRateLimiter(window=0))
+            for text in "abc":
+                try:
+                    _raise_value_error(text)
+                except ValueError as e:
+                    reporter.submit(bot, "on_message", e)
+            await asyncio.sleep(0.005)  # let the worker start sending the first batch
+            await reporter.close()
+
+        with mock.patch.dict(os.environ, {'ERROR_CHANNEL_ID': '1'}):
+            asyncio.run(report())
+        self.assertEqual(sum("ValueError" in content for content in channel.sent), 3)
+
+
+class _SizedEmbed:
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+class _FakeChannel:
+    def __init__(self, fail_first=False):
+        self.fail_first = fail_first
+        self.sent = []
+
+    async def send(self, content, embeds=None):
+        await asyncio.sleep(0.01)
+        if self.fail_first:
+            self.fail_first = False
+            raise discord.HTTPException(mock.Mock(status=400, reason="Bad Request"), "Invalid Form Body")
+        self.sent.append(content)
+
+
+class TestErrorStore(unittest.TestCase):
+    """Test the local JSON-lines error log and its index."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    @staticmethod
+    def _entry(fingerprint, seconds_ago=0):
+        return {'time': time.time() - seconds_ago, 'fingerprint': fingerprint, 'type': 'builtins.ValueError',
+                'message': 'bad', 'command': 'on_message', 'source': 'event',
+                'guild_id': None, 'channel_id': None, 'user_id': None}
+
+    def test_top_errors(self):
+        store = ErrorStore(self.temp_dir.name)
+        for fingerprint in ["a", "b", "b", "c", "c", "c"]:
+            store.append(self._entry(fingerprint))
+        store.append(self._entry("old", seconds_ago=3 * 24 * 3600))
+        since = datetime.now() - timedelta(days=1)
+        self.assertEqual([(error['fingerprint'], error['count']) for error in store.top_errors(since, limit=2)],
+                         [("c", 3), ("b", 2)])
+        self.assertEqual(len(list(store.iter_errors())), 7)
+
+        # a new store rebuilds its index from the log if the index file is missing
+        os.remove(store.index_file)
+        self.assertEqual(len(ErrorStore(self.temp_dir.name).top_errors(since)), 3)
+
+    def test_rotation(self):
+        store = ErrorStore(self.temp_dir.name, max_bytes=500, backup_count=2)
+        for _ in range(5):
+            for _ in range(3):
+                store.append(self._entry("a"))
+            store.flush()
+        self.assertTrue(os.path.exists(f"{store.log_file}.2"))
+        self.assertFalse(os.path.exists(f"{store.log_file}.3"))
+        self.assertEqual(store.top_errors(datetime.now() - timedelta(days=1))[0]['count'], 15)
+
+
+class TestTaskRegistry(unittest.IsolatedAsyncioTestCase):
+    """Test group concurrency limits and draining of tracked tasks."""
+
+    async def test_group_limit_queues_tasks(self):
+        registry = TaskRegistry()
+        registry.set_group_limit("downloads", 2)
+        release = asyncio.Event()
+        tasks = [registry.create_task(release.wait(), "download", "downloads") for _ in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(registry.live_counts(), {"downloads": {"running": 2, "queued": 1}})
+
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(registry.live_counts(), {})
+        self.assertEqual([info.state for info in registry.history], ["done"] * 3)
+        self.assertTrue(all(info.duration is not None for info in registry.history))
+
+    async def test_drain_cancels_stragglers(self):
+        registry = TaskRegistry()
+        registry.create_task(asyncio.sleep(0), "quick")
+        registry.create_task(asyncio.sleep(60), "slow")
+        self.assertEqual(await registry.drain(timeout=0.1), 1)
+        self.assertEqual(sorted(info.state for info in registry.history), ["cancelled", "done"])
+
+
+class TestExecutorPools(unittest.IsolatedAsyncioTestCase):
+    """Test running work in the named executor pools."""
+
+    async def test_metrics(self):
+        pools = ExecutorPools()
+        self.addCleanup(pools.shutdown)
+        self.assertEqual(await pools.run('io', sum, [1, 2, 3]), 6)
+        with self.assertRaises(ZeroDivisionError):
+            await pools.run('io', divmod, 1, 0)
+        metrics = pools.metrics()['io']
+        self.assertEqual((metrics['submitted'], metrics['completed'], metrics['failed'], metrics['pending']),
+                         (2, 1, 1, 0))
+        with self.assertRaises(ValueError):
+            await pools.run('gpu', sum, [])
+
+    async def test_configure_keeps_queued_jobs(self):
+        """Resizing a pool shouldn't cancel the jobs already waiting in it."""
+        pools = ExecutorPools()
+        self.addCleanup(pools.shutdown)
+        pools.configure('io', 1)
+        jobs = [asyncio.ensure_future(pools.run('io', time.sleep, 0.02)) for _ in range(3)]
+        await asyncio.sleep(0.005)
+        pools.configure('io', 4)
+        self.assertEqual(await asyncio.gather(*jobs), [None, None, None])
+        self.assertEqual(pools['io'].max_workers, 4)
+
+    async def test_jpenratio_many(self):
+        contents = ["hello", "こんにちは", "hello こんにちは", "123"] * 3
+        self.assertEqual(await jpenratio_many(contents, executor='io', chunk_size=5),
+                         [jpenratio(content) for content in contents])
+
+
+class _FakeReporter:
+    def __init__(self):
+        self.errors = []
+
+    def submit(self, bot, ctx_or_event, error, *args):
+        self.errors.append(error)
+
+
+class TestLoopLagMonitor(unittest.IsolatedAsyncioTestCase):
+    """Test measuring event loop lag and catching the code that blocks it."""
+
+    @staticmethod
+    def _block_loop():
+        time.sleep(0.3)
+
+    async def test_stall_is_reported_with_stack(self):
+        reporter = _FakeReporter()
+        monitor = LoopLagMonitor(interval=0.01, threshold=0.1, reporter=reporter)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        await asyncio.sleep(0.05)
+        self._block_loop()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(monitor.stalls, 1)
+        self.assertEqual(len(reporter.errors), 1)
+        self.assertIn("_block_loop", [frame.name for frame in reporter.errors[0].stack])
+        self.assertGreaterEqual(monitor.max_lag, 0.2)
+        self.assertEqual(sum(monitor.metrics()['histogram'].values()), monitor.samples)
+        self.assertEqual(reporter.errors[0].site.name, "_block_loop")
+
+    def test_stall_fingerprint_ignores_sampled_frames(self):
+        """Stalls blocked at the same place in our code should share a fingerprint, wherever the sample landed."""
+        copy_file = copy.__file__
+        fingerprints = set()
+        for inner in (["deepcopy"], ["deepcopy", "_deepcopy_dict"], ["deepcopy", "_deepcopy_list", "deepcopy"]):
+            stack = traceback.StackSummary.from_list(
+                [("/home/pi/Documents/Rai/cogs/logger.py", 80, "dump", "data = deepcopy(self.db)")] +
+                [(copy_file, line, name, "") for line, name in enumerate(inner, 100)])
+            stall = LoopStall("Event loop was blocked", stack, _stall_site(stack))
+            self.assertEqual(stall.site.name, "dump")
+            fingerprints.add(error_fingerprint(stall))
+        self.assertEqual(len(fingerprints), 1)
+
+    async def test_restart_replaces_watchdog(self):
+        """stop() then start() should leave a single watchdog thread running."""
+        monitor = LoopLagMonitor(interval=0.01, threshold=0.2)
+        monitor.start()
+        old_watchdog = monitor._watchdog
+        monitor.stop()
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        old_watchdog.join(1)
+        self.assertFalse(old_watchdog.is_alive())
+        self.assertTrue(monitor._watchdog.is_alive())
+
+    def test_start_outside_event_loop(self):
+        monitor = LoopLagMonitor()
+        monitor.start()
+        self.assertIsNone(monitor._watchdog)
+
+
+@instrumented
+def _instrumented_divide(a, b):
+    return a / b
+
+
+@instrumented
+async def _instrumented_sleep():
+    await asyncio.sleep(0)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test the opt-in call/error/latency metrics of instrumented helpers."""
+
+    def setUp(self):
+        was_enabled = instrumentation.enabled
+        self.addCleanup(lambda: instrumentation.enable() if was_enabled else instrumentation.disable())
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        instrumentation.disable()
+        _instrumented_divide(1, 1)
+        self.assertEqual(instrumentation.snapshot()['_instrumented_divide']['calls'], 0)
+
+    def test_counts_and_prometheus_export(self):
+        instrumentation.enable()
+        _instrumented_divide(1, 1)
+        with self.assertRaises(ZeroDivisionError):
+            _instrumented_divide(1, 0)
+        asyncio.run(_instrumented_sleep())
+
+        snapshot = instrumentation.snapshot()
+        self.assertEqual((snapshot['_instrumented_divide']['calls'], snapshot['_instrumented_divide']['errors']),
+                         (2, 1))
+        self.assertEqual(sum(snapshot['_instrumented_sleep']['histogram'].values()), 1)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'metrics.prom')
+            instrumentation.write_prometheus(path)
+            with open(path) as read_file:
+                text = read_file.read()
+        self.assertIn('botutils_helper_calls_total{helper="_instrumented_divide"} 2', text)
+        self.assertIn('botutils_helper_latency_seconds_bucket{helper="_instrumented_divide",le="+Inf"} 2', text)
+
+
+class TestMessageQueueStore(unittest.TestCase):
+    """Test the append-only segment files used to persist the message queue."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_sync_writes_only_changes(self):
+        """A sync should only append new or changed messages, and load() should return the last synced queue."""
+        store = MessageQueueStore(self.temp_dir.name)
+        self.addCleanup(store.close)
+        self.assertIsNone(store.load())
+        queue = [{'id': i, 'content': f"message {i}"} for i in range(5)]
+        store.sync(queue)
+        size = os.path.getsize(store.segments()[-1])
+
+        queue = queue[2:] + [{'id': 5, 'content': "message 5"}]
+        queue[0] = {'id': 2, 'content': "edited"}
+        store.sync(queue)
+        store.sync(queue)  # nothing changed: only another snapshot is written
+        self.assertLess(os.path.getsize(store.segments()[-1]) - size, 2 * size)
+        self.assertEqual(MessageQueueStore(self.temp_dir.name).load(), queue)
+
+    def test_ring_eviction_keeps_live_messages(self):
+        """Deleting the oldest segment shouldn't lose messages the queue still holds."""
+        store = MessageQueueStore(self.temp_dir.name, segment_size=300, max_segments=3)
+        self.addCleanup(store.close)
+        queue = [{'id': 0, 'content': "stays in the queue"}]
+        for i in range(1, 60):
+            queue = queue[:1] + queue[-4:] + [{'id': i, 'content': f"message {i}"}]
+            store.sync(queue)
+        self.assertEqual(len(store.segments()), 3)
+        self.assertEqual(MessageQueueStore(self.temp_dir.name).load(), queue)
+
+    def test_carried_messages_on_disk_before_delete(self):
+        """A crash right after the oldest segment is deleted shouldn't lose the messages copied out of it."""
+        store = MessageQueueStore(self.temp_dir.name, segment_size=300, max_segments=2)
+        self.addCleanup(store.close)
+        loaded_after_delete = []
+        remove = os.remove
+
+        def remove_and_reload(path):
+            remove(path)
+            loaded_after_delete.append(MessageQueueStore(self.temp_dir.name).load())
+
+        queue = [{'id': 0, 'content': "stays in the queue"}]
+        with mock.patch('os.remove', remove_and_reload):
+            for i in range(1, 30):
+                queue = queue[:1] + queue[-2:] + [{'id': i, 'content': f"message {i}"}]
+                store.sync(queue)
+        self.assertTrue(loaded_after_delete)
+        self.assertTrue(all(loaded and loaded[0]['id'] == 0 for loaded in loaded_after_delete))
+
+    def test_reopen_ignores_torn_write(self):
+        store = MessageQueueStore(self.temp_dir.name)
+        store.sync([{'id': 1}, {'id': 2}])
+        store.close()
+        with open(store.segments()[-1], 'ab') as segment:
+            segment.write(b'\x00\x05\x00\x00')  # a header cut off mid-write
+
+        reopened = MessageQueueStore(self.temp_dir.name)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.load(), [{'id': 1}, {'id': 2}])
+        reopened.sync([{'id': 2}, {'id': 3}])
+        self.assertEqual(MessageQueueStore(self.temp_dir.name).load(), [{'id': 2}, {'id': 3}])
+
+
+class TestStatsRollup(unittest.TestCase):
+    """Test compacting old per-day bot.stats data into weekly and monthly buckets."""
+
+    @staticmethod
+    def _stats(today, days):
+        messages = {}
+        for days_ago in range(days):
+            day = (today - timedelta(days=days_ago)).strftime("%Y%m%d")
+            messages[day] = {"123": {"count": 2, "lang": {"en": 1}}, "456": {"count": 1}}
+        return {"243838819743432704": {"messages": messages, "voice": {"in_voice": {"123": 1700000000}}}}
+
+    def test_compaction_keeps_totals(self):
+        today = date(2026, 10, 19)
+        stats = self._stats(today, 400)
+        messages = stats["243838819743432704"]["messages"]
+        before = sum_stats(messages)
+        last_week_before = sum_stats(messages, today - timedelta(days=7))
+
+        self.assertGreater(StatsRollup(daily_days=30, weekly_days=182).compact(stats, today), 0)
+        self.assertEqual(sum_stats(messages), before)
+        self.assertEqual(sum_stats(messages, today - timedelta(days=7)), last_week_before)
+        self.assertEqual(before["123"]["count"], 800)
+        self.assertEqual(stats["243838819743432704"]["voice"], {"in_voice": {"123": 1700000000}})
+
+        # roughly 30 days + 22 weeks + 7 months, instead of 400 days
+        self.assertLess(len(messages), 70)
+        self.assertIn("20261019", messages)
+        self.assertIn("2026-W30", messages)
+        self.assertIn("2025-10", messages)
+
+    def test_weeks_split_at_month_boundaries(self):
+        """Month totals shouldn't depend on whether the days went through week buckets first."""
+        days = [date(2025, 12, 20) + timedelta(days=i) for i in range(22)]  # 2025-12-20 to 2026-01-10
+        direct = {day.strftime("%Y%m%d"): 1 for day in days}
+        via_weeks = dict(direct)
+        rollup = StatsRollup(daily_days=1, weekly_days=60)
+        rollup.compact_series(via_weeks, date(2026, 1, 20))
+        self.assertIn("2026-W01-12", via_weeks)
+        self.assertIn("2026-W01-01", via_weeks)
+        rollup.compact_series(via_weeks, date(2026, 6, 1))
+        rollup.compact_series(direct, date(2026, 6, 1))
+        self.assertEqual(via_weeks, {"2025-12": 12, "2026-01": 10})
+        self.assertEqual(direct, via_weeks)
+        self.assertEqual(sum_stats(via_weeks, date(2026, 1, 1)), 10)
+
+    def test_compaction_is_stable(self):
+        today = date(2026, 10, 19)
+        stats = self._stats(today, 200)
+        rollup = StatsRollup()
+        rollup.compact(stats, today)
+        snapshot = repr(stats)
+        self.assertEqual(rollup.compact(stats, today), 0)
+        self.assertEqual(repr(stats), snapshot)
+
+
+class _FakeExtensionBot:
+    def __init__(self, extensions, broken):
+        self.extensions = dict.fromkeys(extensions)
+        self.broken = broken
+        self.error = commands.ExtensionFailed(broken, SyntaxError("invalid syntax"))
+        self.calls = []
+
+    async def unload_extension(self, name):
+        self.calls.append(("unload", name))
+        del self.extensions[name]
+
+    async def reload_extension(self, name):
+        self.calls.append(("reload", name))
+        if name == self.broken:
+            raise self.error
+
+
+class TestSafeGitPull(unittest.IsolatedAsyncioTestCase):
+    """Test fast-forwarding a clone and listing what changed, against a local bare repo."""
+
+    @staticmethod
+    def _git(cwd, *args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                       cwd=cwd, check=True, capture_output=True)
+
+    def _commit(self, repo, path, content):
+        os.makedirs(os.path.dirname(os.path.join(repo, path)), exist_ok=True)
+        with open(os.path.join(repo, path), 'w') as write_file:
+            write_file.write(content)
+        self._git(repo, "add", path)
+        self._git(repo, "commit", "-m", f"change {path}")
+        self._git(repo, "push", "-q", "origin", "HEAD")
+
+    async def test_pull_lists_changed_cogs(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        origin, upstream_clone, clone = (os.path.join(temp_dir.name, name) for name in ("origin", "up", "clone"))
+        self._git(temp_dir.name, "init", "-q", "--bare", origin)
+        self._git(temp_dir.name, "clone", "-q", origin, upstream_clone)
+        self._commit(upstream_clone, "Rai.py", "print('hi')\n")
+        self._git(temp_dir.name, "clone", "-q", origin, clone)
+
+        result = await safe_git_pull(clone)
+        self.assertFalse(result.updated)
+        self.assertTrue(result.startswith("Already up to date"))  # still usable as the old string result
+        self.assertEqual("Pulled: " + result, f"Pulled: {result.message}")
+
+        self._commit(upstream_clone, "cogs/logger.py", "x = 1\n")
+        self._commit(upstream_clone, "cogs/utils/helper_functions.py", "y = 2\n")
+        result = await safe_git_pull(clone)
+        self.assertTrue(result.updated)
+        self.assertEqual(result.changed_extensions(), ["cogs.logger"])
+        self.assertEqual(result.other_changes(), ["cogs/utils/helper_functions.py"])
+
+        self._git(upstream_clone, "rm", "-q", "cogs/logger.py")
+        self._commit(upstream_clone, "cogs/questions.py", "z = 3\n")
+        self._commit(upstream_clone, "cogs/stats.py", "w = 4\n")
+        result = await safe_git_pull(clone)
+        self.assertEqual(result.deleted_extensions(), ["cogs.logger"])
+        self.assertEqual(result.changed_extensions(), ["cogs.questions", "cogs.stats"])
+
+        bot = _FakeExtensionBot(["cogs.logger", "cogs.questions", "cogs.stats"], broken="cogs.questions")
+        self.assertEqual(await reload_changed_extensions(bot, result),
+                         (["cogs.logger", "cogs.stats"], {"cogs.questions": bot.error}))
+        self.assertEqual(bot.calls, [("unload", "cogs.logger"), ("reload", "cogs.questions"), ("reload", "cogs.stats")])
+
+        with open(os.path.join(clone, "untracked.txt"), 'w') as write_file:
+            write_file.write("dirty")
+        with self.assertRaisesRegex(RuntimeError, "uncommitted or untracked"):
+            await safe_git_pull(clone)
+
+
+class TestSelfTestCache(unittest.TestCase):
+    def test_source_hash_tracks_contents(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'bot_utils.py')
+            with open(path, 'w') as write_file:
+                write_file.write("x = 1\n")
+            first = _source_hash([path])
+            self.assertEqual(first, _source_hash([path]))
+            with open(path, 'a') as write_file:
+                write_file.write("y = 2\n")
+            self.assertNotEqual(first, _source_hash([path]))
+
+
+class TestImportTime(unittest.TestCase):
+    """Importing bot_utils should stay cheap: heavy optional dependencies are imported when first needed."""
+    # self time of the bot_utils module, as a fraction of the time discord.py takes to import in the same process,
+    # so that the budget holds on slower machines too
+    IMPORT_BUDGET = 0.25
+
+    @staticmethod
+    def _import_times() -> tuple[str, dict[str, tuple[int, int]]]:
+        """The lazily imported modules that got imported anyway, and {module: (self us, cumulative us)}"""
+        code = ("import sys, cogs.utils.BotUtils.bot_utils; "
+                "print([name for name in ('emoji', 'concurrent.futures.process') if name in sys.modules])")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                capture_output=True, text=True, env=env, check=True)
+        times = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                self_time, cumulative, name = line.split(":", 1)[1].split("|")
+                if self_time.strip().isdigit():
+                    times[name.strip()] = (int(self_time), int(cumulative))
+        return result.stdout.strip(), times
+
+    def test_heavy_imports_deferred(self):
+        self.assertEqual(self._import_times()[0], "[]")
+
+    @unittest.skipIf(os.getenv("BOTUTILS_SELF_TEST"), "timings are unreliable while the bot is starting up")
+    def test_import_budget(self):
+        _, times = self._import_times()
+        self_time = times["cogs.utils.BotUtils.bot_utils"][0]
+        reference = times["discord"][1]
+        self.assertLess(self_time, reference * self.IMPORT_BUDGET,
+                        f"importing bot_utils took {self_time}us, over {self.IMPORT_BUDGET:.0%} of the "
+                        f"{reference}us discord.py took")
+
+
+class TestBenchmarkComparison(unittest.TestCase):
+    def test_flags_regressions_past_threshold(self):
+        baseline = {'benchmarks': {'a': {'min': 1.0}, 'b': {'min': 1.0}}}
+        current = {'benchmarks': {'a': {'min': 1.2}, 'b': {'min': 1.3}, 'new': {'min': 5.0}}}
+        regressions = compare_results(baseline, current, threshold=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("b:"))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file